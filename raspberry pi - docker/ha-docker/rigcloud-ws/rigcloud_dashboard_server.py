@@ -4,9 +4,22 @@ import asyncio
 import json
 import threading
 import time
-import boto3
 import csv
-
+import gzip
+import hashlib
+import heapq
+import math
+import mimetypes
+import queue
+import re
+import socket
+import sqlite3
+import sys
+import uuid
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left, bisect_right, insort
 from pathlib import Path
 from typing import Dict, Any, List
 
@@ -14,17 +27,22 @@ import paho.mqtt.client as mqtt
 from paho.mqtt.client import CallbackAPIVersion
 
 import uvicorn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, APIRouter
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, APIRouter, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, Response
 from pathlib import Path
 from contextlib import asynccontextmanager
+from abc import ABC, abstractmethod
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List
-from boto3.dynamodb.conditions import Key
+from decimal import Decimal
+
+try:
+    import brotli  # optional: python -m pip install brotli
+except ImportError:
+    brotli = None
 
 dynamodb = None
 
@@ -34,6 +52,9 @@ USE_AWS_DB = "true"
 
 #os.getenv("USE_AWS_DB", "false").lower() == "true"
 
+# flightsheet storage: "sqlite" (local file) or "dynamodb"
+FLIGHTSHEET_BACKEND = os.getenv("FLIGHTSHEET_BACKEND", "dynamodb" if USE_AWS_DB else "sqlite")
+
 router = APIRouter()
 
 # ----------------------------
@@ -48,6 +69,9 @@ class FlightSheetEntryIn(BaseModel):
 class FlightSheetPutIn(BaseModel):
     entries: List[FlightSheetEntryIn]
 
+class RigTagsIn(BaseModel):
+    tags: List[str]
+
 # ================================================================
 # MQTT CONFIG
 # ================================================================
@@ -106,15 +130,35 @@ STATIC_DIR = BASE_DIR / "static"
 API_BIND = os.getenv("API_BIND", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "8765"))
 
-MQTT_TOPIC_FILTER = os.getenv("MQTT_TOPIC_FILTER", "rigcloud/+/+")
+# status messages; command responses and presence are subscribed on top
+MQTT_TOPIC_FILTER = os.getenv("MQTT_TOPIC_FILTER", "rigcloud/+/status")
 
 BROADCAST_INTERVAL = float(os.getenv("BROADCAST_INTERVAL", "10"))
 
+# WEB_WORKERS > 1: this process only ingests MQTT and feeds that many
+# uvicorn workers over 127.0.0.1:INGEST_PORT (see MULTI-WORKER INGEST)
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+INGEST_PORT = int(os.getenv("INGEST_PORT", "8766"))
+RIGCLOUD_WORKER = os.getenv("RIGCLOUD_WORKER") == "1"  # set for the workers
+INGEST_SERVER = WEB_WORKERS > 1 and not RIGCLOUD_WORKER
+
+# MQTT_SHARE_GROUP: several dashboards split status ingest through an
+# MQTT v5 shared subscription and swap the results (see INGEST SHARDING)
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "")
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", "1"))
+# unique per start: containers all run as PID 1 and may share a hostname
+INSTANCE_ID = os.getenv("INSTANCE_ID", f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}")
+
 # ================================================================
 # GLOBAL STATE
 # ================================================================
 
 CMD_ALL_TOPIC = "rigcloud/all/cmd"
+CHECK_ALL_TOPIC = "rigcloud/all/check"
+CMD_GROUP_TOPIC = "rigcloud/group/{}/cmd"
+RIG_GROUPS_TOPIC = "rigcloud/{}/groups"
+PRESENCE_FILTER = "rigcloud/+/presence"
+CMD_RESPONSE_FILTER = "rigcloud/+/cmd_response"
 
 mqtt_client = None
 
@@ -135,6 +179,8 @@ rigs_lock = threading.Lock()
 connected_clients: List[WebSocket] = []
 clients_lock = asyncio.Lock()
 
+ws_clients: Dict[str, WebSocket] = {}   # client id -> socket, for command replies
+
 # ================================================================
 # RIG REGISTRY (identity cache)
 # ================================================================
@@ -192,11 +238,17 @@ def load_aws_credentials_from_csv(csv_path: str | Path) -> dict:
 # ================================================================
 # USE_AWS_DB
 # ================================================================
+# boto3 is only imported, and the table only checked / created, when the
+# DynamoDB backend is selected. That happens in the background after
+# startup (see flightsheet_store_startup) so uvicorn binds immediately.
+
+def init_dynamodb():
+    global dynamodb, flightsheets_table
 
-from botocore.exceptions import ClientError
+    import boto3
+    from botocore.exceptions import ClientError
 
-if USE_AWS_DB:
-    log("use aws...")
+    log("[AWS] use aws...")
 
     AWS_KEYS_CSV = os.getenv(
         "AWS_KEYS_CSV",
@@ -237,10 +289,12 @@ if USE_AWS_DB:
         else:
             raise
 
+    return flightsheets_table
 
-from botocore.exceptions import ClientError
 
 def ensure_flightsheets_table(dynamodb):
+    from botocore.exceptions import ClientError
+
     try:
         table = dynamodb.Table("RigCloudFlightsheets")
         table.load()  # forces DescribeTable
@@ -252,7 +306,11 @@ def ensure_flightsheets_table(dynamodb):
             )
         raise
 
-def delete_flightsheet_if_exists(flightsheet_id: str) -> int:
+def delete_flightsheet_if_exists(flightsheet_id: str, table=None) -> int:
+    from boto3.dynamodb.conditions import Key
+
+    table = table or flightsheets_table
+
     log(f"[FS DELETE] deleting flightsheet {flightsheet_id}")
     deleted = 0
     last_key = None
@@ -264,9 +322,9 @@ def delete_flightsheet_if_exists(flightsheet_id: str) -> int:
         if last_key:
             args["ExclusiveStartKey"] = last_key
 
-        resp = flightsheets_table.query(**args)
+        resp = table.query(**args)
 
-        with flightsheets_table.batch_writer() as batch:
+        with table.batch_writer() as batch:
             for item in resp.get("Items", []):
                 # Use only the primary key for deletion
                 batch.delete_item(
@@ -284,433 +342,2571 @@ def delete_flightsheet_if_exists(flightsheet_id: str) -> int:
     return deleted
 
 # ================================================================
-# BROADCAST LOOP
+# FLIGHTSHEET STORE (pluggable backend)
 # ================================================================
+# The flightsheet routes only talk to a FlightsheetStore. Rows have the
+# same shape on every backend:
+#   {"FlightsheetId", "GpuId", "Key", "Value", "UpdatedAt"}
+# SQLite (default) keeps them in a local file; DynamoDB is used when
+# FLIGHTSHEET_BACKEND=dynamodb (or USE_AWS_DB=true).
+
+FLIGHTSHEET_DB = os.getenv("FLIGHTSHEET_DB", str(BASE_DIR / "rigcloud_flightsheets.db"))
+
+
+class FlightsheetStore(ABC):
+    name = "none"
+
+    @abstractmethod
+    def scan(self) -> List[dict]:
+        """Every row of every flightsheet."""
+
+    @abstractmethod
+    def rows(self, flightsheet_id: str) -> Dict[int, dict]:
+        """Rows of one flightsheet keyed by GpuId."""
+
+    @abstractmethod
+    def apply(self, flightsheet_id: str, puts: List[dict], deletes: List[int]) -> None:
+        """
+        Upsert `puts` and delete GpuIds in `deletes`. Atomic on SQLite and
+        on DynamoDB up to TRANSACTION_LIMIT actions; larger DynamoDB saves
+        are batch writes and can be left half applied by a failure.
+        """
+
+    @abstractmethod
+    def delete(self, flightsheet_id: str) -> int:
+        """Delete a whole flightsheet, return the number of rows removed."""
+
+
+class SqliteFlightsheetStore(FlightsheetStore):
+    name = "sqlite"
+
+    COLUMNS = ("FlightsheetId", "GpuId", "Key", "Value", "UpdatedAt")
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS flightsheets ("
+                " FlightsheetId TEXT NOT NULL,"
+                " GpuId INTEGER NOT NULL,"
+                " Key TEXT NOT NULL,"
+                " Value TEXT NOT NULL,"
+                " UpdatedAt INTEGER NOT NULL,"
+                " PRIMARY KEY (FlightsheetId, GpuId)) WITHOUT ROWID"
+            )
 
-async def broadcast_loop():
-    log("[Broadcast] Loop started")
-    global last_refresh_ts
-
-    try:
-        while True:
-            await asyncio.sleep(BROADCAST_INTERVAL)
-
-            # ---- hard stop check (sleep may have completed after stop) ----
-            if broadcast_stop.is_set():
-                break
-
-            # ---- ensure clients still exist ----
-            async with clients_lock:
-                if not connected_clients:
-                    continue
-
-            now = time.time()
-
-            # ---- send refresh if due ----
-            if now - last_refresh_ts >= BROADCAST_INTERVAL:
-                mqtt_publish(
-                    CMD_ALL_TOPIC,
-                        {
-                            "id": f"refresh-{int(time.time())}",
-                            "command": "refresh"
-                        }
-                )
-                last_refresh_ts = now
-                log("[MQTT] Refresh requested")
-
-            # ---- OFFLINE DETECTION + SNAPSHOT BUILD ----
-            with rigs_lock, known_rigs_lock:
-                snapshot = {}
-
-                for rig in known_rigs:
-                    info = rigs.get(rig)
-
-                    if info:
-                        last_update = info.get("updated", 0)
-                        info["online"] = (now - last_update) <= REFRESH_TIMEOUT
-                        snapshot[rig] = info
-                    else:
-                        # rig known but currently offline with no data
-                        snapshot[rig] = {
-                            "timestamp": 0,
-                            "updated": 0,
-                            "online": False,
-                            "data": {},
-                        }
+        log(f"[FS] SQLite flightsheet store at {path}")
 
-            if not snapshot:
-                continue
+    def scan(self) -> List[dict]:
+        with self.lock:
+            return [dict(r) for r in self.conn.execute("SELECT * FROM flightsheets")]
 
-            async with clients_lock:
-                clients = list(connected_clients)
+    def rows(self, flightsheet_id: str) -> Dict[int, dict]:
+        with self.lock:
+            cur = self.conn.execute(
+                "SELECT * FROM flightsheets WHERE FlightsheetId = ?", (flightsheet_id,)
+            )
+            return {r["GpuId"]: dict(r) for r in cur}
 
-            if not clients:
-                continue
+    def apply(self, flightsheet_id: str, puts: List[dict], deletes: List[int]) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO flightsheets VALUES (?, ?, ?, ?, ?)",
+                [tuple(item[c] for c in self.COLUMNS) for item in puts],
+            )
+            self.conn.executemany(
+                "DELETE FROM flightsheets WHERE FlightsheetId = ? AND GpuId = ?",
+                [(flightsheet_id, gpu) for gpu in deletes],
+            )
 
-            message = {"rigs": snapshot}
+    def delete(self, flightsheet_id: str) -> int:
+        log(f"[FS DELETE] deleting flightsheet {flightsheet_id}")
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "DELETE FROM flightsheets WHERE FlightsheetId = ?", (flightsheet_id,)
+            )
+            return cur.rowcount
 
-            stale = []
-            for ws in clients:
-                try:
-                    await ws.send_json(message)
-                except Exception:
-                    stale.append(ws)
 
-            if stale:
-                async with clients_lock:
-                    for ws in stale:
-                        if ws in connected_clients:
-                            connected_clients.remove(ws)
+class DynamoFlightsheetStore(FlightsheetStore):
+    name = "dynamodb"
 
-    finally:
-        log("[Broadcast] Loop stopped")
+    TRANSACTION_LIMIT = 100  # TransactWriteItems max actions
 
-# ================================================================
-# HTTP ROUTES
-# ================================================================
+    def __init__(self, table):
+        self.table = table
 
-@router.get("/")
-def serve_root():
-    index = STATIC_DIR / "index.html"
-    if not index.exists():
-        return {"error": "static/index.html missing in container"}
-    return FileResponse(index)
+    @staticmethod
+    def plain(item: dict) -> dict:
+        # numbers come back as Decimal; rows look the same as on SQLite
+        return {k: int(v) if isinstance(v, Decimal) else v for k, v in item.items()}
 
-@router.get("/rigs")
-def get_rigs():
-    """Return latest rigs snapshot (debug/API)."""
-    with rigs_lock:
-        snapshot = dict(rigs)
-    return {"rigs": snapshot}
+    def scan(self) -> List[dict]:
+        items = []
+        args = {"ConsistentRead": True}
 
-@router.post("/refresh")
-def refresh_all():
-    mqtt_publish(
-        CMD_ALL_TOPIC,
-        {
-            "id": f"refresh-{int(time.time())}",
-            "command": "refresh"
-        }
-    )
-    return {"status": "refresh sent"}
+        while True:
+            resp = self.table.scan(**args)
+            items.extend(self.plain(item) for item in resp.get("Items", []))
 
-@router.post("/reset")
-def reset_known_rigs():
-    global last_refresh_ts
-    last_refresh_ts = time.time()
+            last_key = resp.get("LastEvaluatedKey")
+            if not last_key:
+                return items
+            args["ExclusiveStartKey"] = last_key
 
-    with known_rigs_lock:
-        known_rigs.clear()
+    def rows(self, flightsheet_id: str) -> Dict[int, dict]:
+        from boto3.dynamodb.conditions import Key
 
-    with rigs_lock:
-        rigs.clear()
+        rows = {}
+        args = {"KeyConditionExpression": Key("FlightsheetId").eq(flightsheet_id), "ConsistentRead": True}
 
-    mqtt_publish(
-        CMD_ALL_TOPIC,
-        {
-            "id": f"refresh-{int(time.time())}",
-            "command": "refresh"
-        }
-    )
+        while True:
+            resp = self.table.query(**args)
+            for item in resp.get("Items", []):
+                item = self.plain(item)
+                rows[item["GpuId"]] = item
 
-    log("[Reset] Cleared known rigs and telemetry (user request)")
-    return {"status": "reset complete"}
+            last_key = resp.get("LastEvaluatedKey")
+            if not last_key:
+                return rows
+            args["ExclusiveStartKey"] = last_key
 
-@router.post("/command")
-async def send_command(payload: dict):
-    rigs = payload.get("rigs", [])
-    command = payload.get("command")
+    def apply(self, flightsheet_id: str, puts: List[dict], deletes: List[int]) -> None:
+        # one transaction (all or nothing) when it fits, else a batch write
+        if len(puts) + len(deletes) <= self.TRANSACTION_LIMIT:
+            from boto3.dynamodb.types import TypeSerializer
+
+            ser = TypeSerializer()
+
+            actions = [
+                {"Put": {"TableName": self.table.name, "Item": {k: ser.serialize(v) for k, v in item.items()}}}
+                for item in puts
+            ]
+            actions += [
+                {"Delete": {"TableName": self.table.name, "Key": {
+                    "FlightsheetId": {"S": flightsheet_id},
+                    "GpuId": {"N": str(gpu)},
+                }}}
+                for gpu in deletes
+            ]
+
+            self.table.meta.client.transact_write_items(TransactItems=actions)
+            return
 
-    if not command or not rigs:
-        return {"error": "missing rigs or command"}
+        with self.table.batch_writer() as batch:
+            for item in puts:
+                batch.put_item(Item=item)
+            for gpu in deletes:
+                batch.delete_item(Key={"FlightsheetId": flightsheet_id, "GpuId": gpu})
 
-    cmd_id = f"cmd-{int(time.time())}"
+    def delete(self, flightsheet_id: str) -> int:
+        return delete_flightsheet_if_exists(flightsheet_id, self.table)
 
-    msg = {
-        "id": cmd_id,
-        "command": command
-    }
 
-    for rig in rigs:
-        topic = f"rigcloud/{rig}/cmd"
-        mqtt_publish(topic, msg)
-        log(f"[CMD] Sent command to {rig}: {command!r}")
+# SQLite opens instantly; DynamoDB is attached by flightsheet_store_startup()
+flightsheet_store: FlightsheetStore | None = None
+flightsheet_store_status = "ready"   # "warming_up" / "unavailable" while DynamoDB connects
 
-    return {
-        "status": "sent",
-        "id": cmd_id,
-        "rigs": rigs
-    }
+if FLIGHTSHEET_BACKEND == "sqlite":
+    flightsheet_store = SqliteFlightsheetStore(FLIGHTSHEET_DB)
+elif FLIGHTSHEET_BACKEND == "dynamodb":
+    flightsheet_store_status = "warming_up"
+else:
+    raise RuntimeError(f"Invalid FLIGHTSHEET_BACKEND: {FLIGHTSHEET_BACKEND}")
 
 # ================================================================
-# FLIGHTSHEETS API
+# METRIC HISTORY (in-memory ring buffers)
 # ================================================================
+# One MetricSeries per rig per metric. Each series keeps raw samples
+# plus 1-minute and 15-minute averages in fixed-size rings, so memory
+# is bounded no matter how long the server runs.
 
-@router.get("/api/flightsheets")
-def get_flightsheets():
-    if not flightsheets_table:
-        return []
+HISTORY_RAW_POINTS = int(os.getenv("HISTORY_RAW_POINTS", "360"))    # ~1h at 10s
+HISTORY_1M_POINTS  = int(os.getenv("HISTORY_1M_POINTS", "1440"))    # 24h
+HISTORY_15M_POINTS = int(os.getenv("HISTORY_15M_POINTS", "672"))    # 7 days
 
-    try:
-        resp = flightsheets_table.scan()
-        items = resp.get("Items", [])
+HISTORY_STEPS = {"1m": 60, "15m": 900}
 
-        log(f"[FS GET] Returning {len(items)} flightsheet items")
-        return items
+history: Dict[str, Dict[str, "MetricSeries"]] = {}
+history_lock = threading.Lock()
 
-    except Exception as e:
-        log(f"[FS GET ERROR] Exception: {e}")
-        return []
 
+class RawRing:
+    """Ring of (timestamp, value) samples backed by two flat arrays."""
 
-@router.put("/api/flightsheets/{flightsheet_id}")
-def put_flightsheet(flightsheet_id: str, payload: FlightSheetPutIn):
-    log(f"[FS PUT] Saving flightsheet: {flightsheet_id}")
+    __slots__ = ("cap", "head", "ts", "vals")
 
-    if not flightsheets_table:
-        raise HTTPException(503, "Flightsheets table not available")
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.head = 0  # oldest slot once the ring is full
+        self.ts = array("I")
+        self.vals = array("f")
 
-    now = int(time.time())
+    def append(self, t: int, v: float) -> None:
+        if len(self.ts) < self.cap:
+            self.ts.append(t)
+            self.vals.append(v)
+            return
 
-    # 1️⃣ Delete existing rows
-    deleted = delete_flightsheet_if_exists(flightsheet_id)
-
-    # 2️⃣ Insert new items
-    inserted = 0
-    with flightsheets_table.batch_writer() as batch:
-        for e in payload.entries:
-            item = {
-                "FlightsheetId": flightsheet_id,
-                "GpuId": int(e.gpu),
-                "Key": e.key.strip().upper(),
-                "Value": e.value,
-                "UpdatedAt": now,
-            }
+        self.ts[self.head] = t
+        self.vals[self.head] = v
+        self.head = (self.head + 1) % self.cap
 
-            batch.put_item(Item=item)
-            inserted += 1
+    def oldest(self) -> int | None:
+        return self.ts[self.head] if self.ts else None
 
-    log(f"[FS PUT] Saved {inserted} entries for flightsheet {flightsheet_id}")
+    def range(self, since: int, until: int):
+        h = self.head
+        ts = self.ts[h:] + self.ts[:h] if h else self.ts
+        vals = self.vals[h:] + self.vals[:h] if h else self.vals
 
-    return {
-        "status": "ok",
-        "deleted": deleted,
-        "inserted": inserted,
-    }
+        lo = bisect_left(ts, since)
+        hi = bisect_right(ts, until)
+        return ts[lo:hi].tolist(), vals[lo:hi].tolist()
 
 
-@router.delete("/api/flightsheets/{flightsheet_id}")
-def delete_flightsheet(flightsheet_id: str):
-    log(f"[FS DELETE] Deleting flightsheet: {flightsheet_id}")
+class BucketRing:
+    """
+    Ring of fixed-width bucket averages.
+    Timestamps are implicit (newest bucket start minus i * step), gaps
+    while a rig is offline are padded with NaN to keep them that way.
+    """
 
-    if not flightsheets_table:
-        raise HTTPException(503, "Flightsheets table not available")
+    __slots__ = ("cap", "step", "head", "vals", "last", "cur", "cur_sum", "cur_n")
+
+    def __init__(self, cap: int, step: int):
+        self.cap = cap
+        self.step = step
+        self.head = 0
+        self.vals = array("f")
+        self.last = 0     # start of newest closed bucket
+        self.cur = 0      # start of open bucket
+        self.cur_sum = 0.0
+        self.cur_n = 0
+
+    def _push(self, v: float) -> None:
+        if len(self.vals) < self.cap:
+            self.vals.append(v)
+            return
 
-    try:
-        deleted = delete_flightsheet_if_exists(flightsheet_id)
-        return {
-            "status": "deleted",
-            "flightsheet_id": flightsheet_id,
-            "deleted_count": deleted
-        }
+        self.vals[self.head] = v
+        self.head = (self.head + 1) % self.cap
+
+    def _close(self) -> None:
+        if self.last:
+            missing = (self.cur - self.last) // self.step - 1
+            for _ in range(min(missing, self.cap)):
+                self._push(math.nan)
+
+        self._push(self.cur_sum / self.cur_n)
+        self.last = self.cur
+
+    def add(self, t: int, v: float) -> None:
+        bucket = t - t % self.step
+
+        if bucket > self.cur:
+            if self.cur_n:
+                self._close()
+            self.cur = bucket
+            self.cur_sum = 0.0
+            self.cur_n = 0
+
+        self.cur_sum += v
+        self.cur_n += 1
+
+    def oldest(self) -> int | None:
+        if self.vals:
+            return self.last - (len(self.vals) - 1) * self.step
+        return self.cur if self.cur_n else None
+
+    def range(self, since: int, until: int):
+        """Return (start, values) where values[i] is the bucket at start + i * step."""
+        h = self.head
+        vals = (self.vals[h:] + self.vals[:h] if h else self.vals).tolist()
+        start = self.last - (len(vals) - 1) * self.step if vals else self.cur
+
+        # open bucket goes last so the newest minute is visible right away
+        if self.cur_n and self.cur > self.last:
+            gap = (self.cur - start) // self.step - len(vals) if vals else 0
+            if gap >= self.cap:
+                vals, start, gap = [], self.cur, 0
+            vals.extend([math.nan] * gap)
+            vals.append(self.cur_sum / self.cur_n)
+
+        lo = max(0, -(-(since - start) // self.step))
+        hi = min(len(vals), (until - start) // self.step + 1)
+
+        if hi <= lo:
+            return start, []
+        return start + lo * self.step, vals[lo:hi]
+
+
+class MetricSeries:
+    __slots__ = ("raw", "m1", "m15")
+
+    def __init__(self):
+        self.raw = RawRing(HISTORY_RAW_POINTS)
+        self.m1 = BucketRing(HISTORY_1M_POINTS, HISTORY_STEPS["1m"])
+        self.m15 = BucketRing(HISTORY_15M_POINTS, HISTORY_STEPS["15m"])
+
+    def add(self, t: int, v: float) -> None:
+        self.raw.append(t, v)
+        self.m1.add(t, v)
+        self.m15.add(t, v)
+
+
+def extract_history_metrics(data: dict) -> Dict[str, float]:
+    """Flatten a telemetry payload into {metric_name: value}."""
+    metrics: Dict[str, float] = {}
+
+    def put(name, value):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = float(value)
+
+    put("cpu.temp", data.get("cpu_temp"))
+    put("cpu.usage", data.get("cpu_usage"))
+    put("load.1m", (data.get("load") or {}).get("1m"))
+    put("memory.percent", (data.get("memory") or {}).get("percent"))
+
+    gpus = data.get("gpus") or []
+    total_watts = 0.0
+
+    for gpu in gpus:
+        idx = gpu.get("index")
+        if idx is None:
+            continue
+
+        put(f"gpu.{idx}.temp", gpu.get("temp"))
+        put(f"gpu.{idx}.power", gpu.get("power_watts"))
+        put(f"gpu.{idx}.fan", gpu.get("fan_percent"))
+        put(f"gpu.{idx}.util", gpu.get("util"))
+
+        watts = gpu.get("power_watts")
+        if isinstance(watts, (int, float)):
+            total_watts += watts
+
+    if gpus:
+        put("power.total", total_watts)
+
+    # ---- per-algorithm totals across all miners ----
+    for key, miner in data.items():
+        if not key.startswith("miner_") or not isinstance(miner, dict):
+            continue
+        if miner.get("status") != "ok":
+            continue
+
+        for algo in miner.get("algorithms") or []:
+            name = algo.get("algorithm")
+            if not name:
+                continue
 
-    except Exception as e:
-        log(f"[FS DELETE ERROR] Error: {e}")
-        raise HTTPException(500, f"Failed to delete flightsheet: {e}")
+            hs = algo.get("hashrate_hs") or (
+                (algo.get("cpu_hashrate_hs") or 0) + (algo.get("gpu_hashrate_hs") or 0)
+            )
+            metrics[f"hashrate.{name}"] = metrics.get(f"hashrate.{name}", 0.0) + float(hs)
 
-# ================================================================
-# WEBSOCKET ENDPOINT
-# ================================================================
+            for field, suffix in (("accepted_shares", "accepted"), ("rejected_shares", "rejected")):
+                count = algo.get(field)
+                if isinstance(count, (int, float)):
+                    metric = f"shares.{name}.{suffix}"
+                    metrics[metric] = metrics.get(metric, 0.0) + float(count)
 
-@router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
+    return metrics
 
-    async with clients_lock:
-        connected_clients.append(websocket)
-        first_client = len(connected_clients) == 1
 
-    log("[WebSocket] Client connected")
+def record_history(rig_name: str, data: dict, now: float, persist: bool = True) -> None:
+    global history_db_dropped
 
-    global broadcast_task
-    if first_client:
-        broadcast_stop.clear()
-        broadcast_task = asyncio.create_task(broadcast_loop())
-        mqtt_publish(
-            CMD_ALL_TOPIC,
-            {
-                "id": f"refresh-{int(time.time())}",
-                "command": "refresh"
-            }
-        )
+    metrics = extract_history_metrics(data)
+    if not metrics:
+        return
 
-        log("[MQTT] Refresh requested (first WS client)")
+    t = int(now)
+    with history_lock:
+        series = history.setdefault(rig_name, {})
+        for name, value in metrics.items():
+            s = series.get(name)
+            if s is None:
+                s = series[name] = MetricSeries()
+            s.add(t, value)
 
-    with rigs_lock:
-        initial_snapshot = dict(rigs)
-    if initial_snapshot:
-        await websocket.send_json({"rigs": initial_snapshot})
+    if persist and HISTORY_DB and not RIGCLOUD_WORKER:  # workers only read the DB
+        try:
+            history_db_queue.put_nowait((rig_name, t, metrics))
+        except queue.Full:
+            history_db_dropped += 1
 
-    try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        log("[WebSocket] Client disconnected")
-    finally:
-        async with clients_lock:
-            if websocket in connected_clients:
-                connected_clients.remove(websocket)
 
-            last_client = len(connected_clients) == 0
+def json_values(vals: list) -> list:
+    # NaN is not valid JSON; gaps are sent as null
+    return [None if v != v else round(v, 2) for v in vals]
 
-        if last_client and broadcast_task:
-            broadcast_stop.set()
-            broadcast_task = None
 
-            with rigs_lock:
-                for info in rigs.values():
-                    info["data"] = {}
-                    info["online"] = False
+def history_mem_query(rig_filter: set, metric_filter: set, res: str, since: int, until: int):
+    """
+    Read history from the in-memory rings.
+    Returns (result, covered) where covered is False when any selected
+    series starts after `since` (e.g. right after a restart). Without the
+    SQLite store the result is complete for what the rings hold; with it
+    an uncovered query stops early, as the caller goes to disk anyway.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    covered = True
+    found = False
+    slack = HISTORY_STEPS.get(res, 60)
+
+    with history_lock:
+        if rig_filter - history.keys():
+            if HISTORY_DB:
+                return out, False
+            covered = False
+
+        for rig, series in history.items():
+            if rig_filter and rig not in rig_filter:
+                continue
 
-            log("[Prune] Cleared live rig telemetry (preserved rig list)")
+            rig_out = {}
+            for name, s in series.items():
+                if metric_filter and name not in metric_filter:
+                    continue
 
-# ================================================================
-# FASTAPI LIFESPAN
-# ================================================================
+                ring = s.raw if res == "raw" else (s.m1 if res == "1m" else s.m15)
+                oldest = ring.oldest()
+                if oldest is None or oldest > since + slack:
+                    if HISTORY_DB:
+                        return out, False
+                    covered = False
+                found = True
+
+                if res == "raw":
+                    ts, vals = ring.range(since, until)
+                    if ts:
+                        rig_out[name] = {"t": ts, "v": json_values(vals)}
+                else:
+                    start, vals = ring.range(since, until)
+                    if vals:
+                        rig_out[name] = {
+                            "start": start,
+                            "step": ring.step,
+                            "v": json_values(vals),
+                        }
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    global main_loop, broadcast_stop, broadcast_task
-    main_loop = asyncio.get_running_loop()
-    broadcast_stop = asyncio.Event()
-    log("[Startup] Dashboard server starting")
-    yield
-    log("[Shutdown] Dashboard server stopping")
+            if rig_out:
+                out[rig] = rig_out
 
-    if broadcast_stop:
-        broadcast_stop.set()
-    broadcast_task = None
+    return out, covered and found
 
 # ================================================================
-# FastAPI
+# METRIC HISTORY (SQLite store)
 # ================================================================
+# Persists the same metrics to a local SQLite file (WAL mode) so history
+# survives restarts. Samples are queued by record_history() and written
+# in batches by a background thread; 1m / 15m / 1h rollups are upserted
+# as running sums at write time. HISTORY_DB="" disables the store.
+
+HISTORY_DB = os.getenv("HISTORY_DB", str(BASE_DIR / "rigcloud_history.db"))
+HISTORY_DB_FLUSH_INTERVAL = float(os.getenv("HISTORY_DB_FLUSH_INTERVAL", "5"))
+HISTORY_DB_PRUNE_INTERVAL = 600  # seconds
+
+# resolution -> (bucket seconds, retention seconds), step 0 = raw samples
+HISTORY_DB_TABLES = {
+    "raw": (0,    int(os.getenv("HISTORY_RAW_RETENTION_DAYS", "1")) * 86400),
+    "1m":  (60,   int(os.getenv("HISTORY_1M_RETENTION_DAYS", "7")) * 86400),
+    "15m": (900,  int(os.getenv("HISTORY_15M_RETENTION_DAYS", "90")) * 86400),
+    "1h":  (3600, int(os.getenv("HISTORY_1H_RETENTION_DAYS", "730")) * 86400),
+}
+
+history_db_queue: queue.Queue = queue.Queue(maxsize=10000)
+history_db_stop = threading.Event()
+history_db_dropped = 0
+
+
+def history_db_connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(HISTORY_DB, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def history_db_init(conn: sqlite3.Connection) -> None:
+    with conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS series ("
+            " id INTEGER PRIMARY KEY,"
+            " rig TEXT NOT NULL,"
+            " metric TEXT NOT NULL,"
+            " UNIQUE (rig, metric))"
+        )
+        for res, (step, _) in HISTORY_DB_TABLES.items():
+            cols = "v REAL NOT NULL" if not step else "sum REAL NOT NULL, n INTEGER NOT NULL"
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS history_{res} ("
+                f" series INTEGER NOT NULL, ts INTEGER NOT NULL, {cols},"
+                f" PRIMARY KEY (series, ts)) WITHOUT ROWID"
+            )
 
-app = FastAPI(lifespan=lifespan)
-
-if MQTT_MODE == "local":
-    app.include_router(router, prefix=BASE_PATH)
-else:
-    app.include_router(router)
-
-# CORS (so dashboard can be opened from anywhere on LAN)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-app.mount(
-    "/static",
-    StaticFiles(directory=STATIC_DIR),
-    name="static"
-)
+def history_db_series_id(conn: sqlite3.Connection, cache: dict, rig: str, metric: str) -> int:
+    key = (rig, metric)
+    sid = cache.get(key)
+    if sid is None:
+        conn.execute("INSERT OR IGNORE INTO series (rig, metric) VALUES (?, ?)", key)
+        sid = conn.execute(
+            "SELECT id FROM series WHERE rig = ? AND metric = ?", key
+        ).fetchone()[0]
+        cache[key] = sid
+    return sid
 
-@app.get("/favicon.ico", include_in_schema=False)
-async def favicon():
-    return FileResponse(STATIC_DIR / "favicon.ico", media_type="image/x-icon")
 
-@app.get("/api/config")
-def get_config():
-    return {
-        "basePath": BASE_PATH
+def history_db_write(conn: sqlite3.Connection, cache: dict, batch: list) -> None:
+    raw_rows = []
+    buckets: Dict[str, Dict[tuple, list]] = {
+        res: {} for res, (step, _) in HISTORY_DB_TABLES.items() if step
     }
 
-# ================================================================
-# MQTT CALLBACKS
-# ================================================================
-def on_connect(client, userdata, flags, reason_code, properties):
-    if reason_code == 0:
-        log(f"[MQTT] Connected to {MQTT_BROKER}:{MQTT_PORT}")
-        client.subscribe(MQTT_TOPIC_FILTER, qos=0)
-        log(f"[MQTT] Subscribed to {MQTT_TOPIC_FILTER}")
-    else:
-        log(f"[MQTT] Connect failed with reason_code={reason_code}")
+    with conn:
+        for rig, t, metrics in batch:
+            for name, v in metrics.items():
+                sid = history_db_series_id(conn, cache, rig, name)
+                raw_rows.append((sid, t, v))
+
+                # pre-aggregate per bucket so each batch upserts a bucket once
+                for res, acc in buckets.items():
+                    step = HISTORY_DB_TABLES[res][0]
+                    slot = acc.setdefault((sid, t - t % step), [0.0, 0])
+                    slot[0] += v
+                    slot[1] += 1
+
+        conn.executemany("INSERT OR REPLACE INTO history_raw VALUES (?, ?, ?)", raw_rows)
+
+        for res, acc in buckets.items():
+            conn.executemany(
+                f"INSERT INTO history_{res} (series, ts, sum, n) VALUES (?, ?, ?, ?) "
+                f"ON CONFLICT (series, ts) DO UPDATE SET "
+                f"sum = sum + excluded.sum, n = n + excluded.n",
+                [(sid, ts, total, n) for (sid, ts), (total, n) in acc.items()],
+            )
 
-def on_message(client, userdata, msg):
-    try:
-        topic = msg.topic
-        data = json.loads(msg.payload.decode("utf-8"))
-        now = time.time()
 
-        # =====================================================
-        # COMMAND RESPONSE
-        # rigcloud/<rig>/cmd_response
-        # =====================================================
-        if topic.endswith("/cmd_response"):
-            log(f"[CMD_RESPONSE] {data.get('rig')} id={data.get('id')}")
-
-            if main_loop:
-                main_loop.call_soon_threadsafe(
-                    lambda: asyncio.create_task(
-                        push_cmd_response_to_ws(data)
-                    )
-                )
-            return
+def history_db_prune(conn: sqlite3.Connection, now: float) -> None:
+    ids = [row[0] for row in conn.execute("SELECT id FROM series")]
 
-        # =====================================================
-        # TELEMETRY / STATUS
-        # rigcloud/<rig>/status
-        # =====================================================
-        rig_name = data.get("rig")
-        if not rig_name:
-            return  # Ignore messages without a rig identity
+    with conn:
+        for res, (_, keep) in HISTORY_DB_TABLES.items():
+            cutoff = int(now) - keep
+            # per-series deletes walk the primary key instead of the table
+            conn.executemany(
+                f"DELETE FROM history_{res} WHERE series = ? AND ts < ?",
+                [(sid, cutoff) for sid in ids],
+            )
 
-        # ---- register rig identity ----
-        with known_rigs_lock:
-            known_rigs.add(rig_name)
 
-        # ---- update live telemetry ----
-        with rigs_lock:
-            rigs[rig_name] = {
-                "timestamp": int(now),
-                "updated": now,
-                "online": True,
-                "data": data,
-            }
+def history_db_thread_main():
+    global history_db_dropped
 
-        # ---- push snapshot to WS (debounced) ----
-        global last_ws_push
-        if connected_clients and now - last_ws_push >= WS_PUSH_MIN_INTERVAL:
-            last_ws_push = now
-            if main_loop:
-                main_loop.call_soon_threadsafe(
-                    lambda: asyncio.create_task(push_snapshot_to_ws())
-                )
+    log(f"[History] SQLite store at {HISTORY_DB}")
 
-    except Exception as e:
-        log(f"[MQTT] Error processing message: {e}")
+    conn = history_db_connect()
+    history_db_init(conn)
+    cache: dict = {}
+    last_prune = 0.0
 
-async def push_cmd_response_to_ws(resp: dict):
-    async with clients_lock:
-        clients = list(connected_clients)
+    while True:
+        stopping = history_db_stop.wait(HISTORY_DB_FLUSH_INTERVAL)
 
-    if not clients:
-        return
+        batch = []
+        while True:
+            try:
+                batch.append(history_db_queue.get_nowait())
+            except queue.Empty:
+                break
 
-    message = {
-        "cmd_response": resp
-    }
+        if history_db_dropped:
+            log(f"[History] Queue full, dropped {history_db_dropped} samples")
+            history_db_dropped = 0
 
-    for ws in clients:
         try:
-            await ws.send_json(message)
-        except:
-            pass
+            if batch:
+                history_db_write(conn, cache, batch)
+
+            now = time.time()
+            if now - last_prune >= HISTORY_DB_PRUNE_INTERVAL:
+                history_db_prune(conn, now)
+                last_prune = now
+
+        except Exception as e:
+            log(f"[History] DB write error: {e}")
+
+        if stopping:
+            break
+
+    conn.close()
+    log("[History] SQLite store closed")
+
+
+def history_db_query(rig_filter: set, metric_filter: set, res: str, since: int, until: int):
+    step = HISTORY_DB_TABLES[res][0]
+    value = "v" if not step else "sum / n"
+    out: Dict[str, Dict[str, Any]] = {}
+
+    conn = sqlite3.connect(HISTORY_DB, timeout=10)
+    try:
+        series = conn.execute("SELECT id, rig, metric FROM series").fetchall()
+
+        for sid, rig, metric in series:
+            if rig_filter and rig not in rig_filter:
+                continue
+            if metric_filter and metric not in metric_filter:
+                continue
+
+            rows = conn.execute(
+                f"SELECT ts, {value} FROM history_{res} "
+                f"WHERE series = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+                (sid, since, until),
+            ).fetchall()
+
+            if not rows:
+                continue
+
+            if not step:
+                entry = {
+                    "t": [ts for ts, _ in rows],
+                    "v": json_values([v for _, v in rows]),
+                }
+            else:
+                start = rows[0][0]
+                vals = [math.nan] * ((rows[-1][0] - start) // step + 1)
+                for ts, v in rows:
+                    vals[(ts - start) // step] = v
+                entry = {"start": start, "step": step, "v": json_values(vals)}
+
+            out.setdefault(rig, {})[metric] = entry
+
+    except sqlite3.OperationalError as e:
+        # store not initialised yet (writer thread hasn't run)
+        log(f"[History] DB read error: {e}")
+
+    finally:
+        conn.close()
+
+    return out
+
+# ================================================================
+# FLEET AGGREGATES (incremental)
+# ================================================================
+# Each online rig contributes a flat {key: value} dict (watts, GPUs,
+# hashrate/shares per algorithm, per miner and per tag). On update the
+# rig's previous contribution is subtracted and the new one added, so
+# the totals never need a full fleet scan. Each key also counts its
+# contributing rigs and is dropped when that reaches zero.
+
+RIG_TAGS_FILE = Path(os.getenv("RIG_TAGS_FILE", str(BASE_DIR / "rig_tags.json")))
+
+rig_tags: Dict[str, List[str]] = {}
+
+fleet_totals: Dict[tuple, list] = {}            # key -> [value, rigs]
+fleet_contrib: Dict[str, Dict[tuple, float]] = {}
+fleet_lock = threading.Lock()
+fleet_version = 0
+
+
+def load_rig_tags() -> None:
+    if not RIG_TAGS_FILE.exists():
+        return
+
+    try:
+        with RIG_TAGS_FILE.open(encoding="utf-8") as f:
+            rig_tags.update({rig: list(tags) for rig, tags in json.load(f).items()})
+        log(f"[Tags] Loaded tags for {len(rig_tags)} rigs")
+    except Exception as e:
+        log(f"[Tags] Failed to load {RIG_TAGS_FILE}: {e}")
+
+
+load_rig_tags()
+
+
+def save_rig_tags() -> None:
+    tmp = RIG_TAGS_FILE.with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(rig_tags, f, indent=2, sort_keys=True)
+    os.replace(tmp, RIG_TAGS_FILE)
+
+
+def set_rig_tags(rig_name: str, tags: List[str]) -> None:
+    if tags:
+        rig_tags[rig_name] = tags
+    else:
+        rig_tags.pop(rig_name, None)
+
+    # move the rig's contribution to its new tags
+    with rigs_lock:
+        info = rigs.get(rig_name)
+        data = live_data(info) if info else None
+    fleet_update(rig_name, data)
+
+
+def rig_contribution(data: dict, tags) -> Dict[tuple, float]:
+    c: Dict[tuple, float] = {}
+
+    def add(key, v):
+        c[key] = c.get(key, 0.0) + v
+
+    gpus = data.get("gpus") or []
+    watts = sum(
+        g.get("power_watts") for g in gpus
+        if isinstance(g.get("power_watts"), (int, float))
+    )
+
+    scopes = [("total",)] + [("tags", tag) for tag in tags]
+    for scope in scopes:
+        add(scope + ("rigs",), 1)
+        add(scope + ("gpus",), len(gpus))
+        add(scope + ("watts",), watts)
+
+    for key, miner in data.items():
+        if not key.startswith("miner_") or not isinstance(miner, dict):
+            continue
+        if miner.get("status") != "ok" or not miner.get("algorithms"):
+            continue
+
+        miner_name = miner.get("miner") or key[len("miner_"):]
+        add(("miners", miner_name, "rigs"), 1)
+
+        for algo in miner["algorithms"]:
+            name = algo.get("algorithm")
+            if not name:
+                continue
+
+            hs = algo.get("hashrate_hs") or (
+                (algo.get("cpu_hashrate_hs") or 0) + (algo.get("gpu_hashrate_hs") or 0)
+            )
+            accepted = algo.get("accepted_shares")
+            rejected = algo.get("rejected_shares")
+
+            targets = [("algorithms", name), ("miners", miner_name)]
+            targets += [("tags", tag, "algorithms", name) for tag in tags]
+
+            for target in targets:
+                add(target + ("hashrate_hs",), float(hs))
+                if isinstance(accepted, (int, float)):
+                    add(target + ("accepted",), accepted)
+                if isinstance(rejected, (int, float)):
+                    add(target + ("rejected",), rejected)
+
+            for scope in scopes:
+                if isinstance(accepted, (int, float)):
+                    add(scope + ("accepted",), accepted)
+                if isinstance(rejected, (int, float)):
+                    add(scope + ("rejected",), rejected)
+
+    # rig count per algorithm, once per rig even if two miners share it
+    for key in [k for k in c if k[0] == "algorithms" and k[2] == "hashrate_hs"]:
+        c[("algorithms", key[1], "rigs")] = 1
+
+    return c
+
+
+def live_data(record: dict) -> dict | None:
+    """Telemetry that counts: online, and not checkpointed (stale) data."""
+    if not record.get("online") or record.get("stale"):
+        return None
+    return record["data"]
+
+
+def fleet_update(rig_name: str, data: dict | None) -> None:
+    """Replace a rig's contribution (data=None removes it)."""
+    global fleet_version
+
+    new = rig_contribution(data, rig_tags.get(rig_name, ())) if data else {}
+
+    with fleet_lock:
+        for key, v in fleet_contrib.pop(rig_name, {}).items():
+            slot = fleet_totals[key]
+            slot[0] -= v
+            slot[1] -= 1
+            if slot[1] == 0:
+                del fleet_totals[key]
+
+        for key, v in new.items():
+            slot = fleet_totals.get(key)
+            if slot is None:
+                slot = fleet_totals[key] = [0.0, 0]
+            slot[0] += v
+            slot[1] += 1
+
+        if new:
+            fleet_contrib[rig_name] = new
+
+        fleet_version += 1
+
+
+def fleet_clear() -> None:
+    global fleet_version
+
+    with fleet_lock:
+        fleet_totals.clear()
+        fleet_contrib.clear()
+        fleet_version += 1
+
+
+def fleet_view() -> dict:
+    view: Dict[str, Any] = {
+        "total": {"rigs": 0, "gpus": 0, "watts": 0.0},
+        "algorithms": {},
+        "miners": {},
+        "tags": {},
+    }
+
+    with fleet_lock:
+        for key, (value, _) in fleet_totals.items():
+            node = view
+            for part in key[:-1]:
+                node = node.setdefault(part, {})
+            node[key[-1]] = int(value) if value.is_integer() else round(value, 2)
+
+        view["version"] = fleet_version
+
+    view["total"]["known_rigs"] = len(known_rigs)
+    return view
+
+# ================================================================
+# RIG INDEXES (for /rigs filters)
+# ================================================================
+# (field, value) -> rig names, maintained under rigs_lock whenever a
+# rig's entry changes, so filtered queries only touch matching rigs.
+
+rig_index: Dict[tuple, set] = {}
+rig_index_keys: Dict[str, set] = {}
+rig_names_sorted: List[str] = []   # for cursor pagination
+
+
+def rig_keys(info: dict) -> set:
+    # checkpointed telemetry is shown, but not searched on until it is fresh
+    data = {} if info.get("stale") else info.get("data") or {}
+    keys = {("online", "true" if info.get("online") else "false")}
+
+    for gpu in data.get("gpus") or []:
+        if gpu.get("name"):
+            keys.add(("gpu", str(gpu["name"]).lower()))
+        if gpu.get("driver_version"):
+            keys.add(("driver", str(gpu["driver_version"]).lower()))
+
+    for key, miner in data.items():
+        if not key.startswith("miner_") or not isinstance(miner, dict):
+            continue
+        if miner.get("status") != "ok" or not miner.get("algorithms"):
+            continue
+
+        keys.add(("miner", (miner.get("miner") or key[len("miner_"):]).lower()))
+        for algo in miner["algorithms"]:
+            if algo.get("algorithm"):
+                keys.add(("algorithm", str(algo["algorithm"]).lower()))
+
+    return keys
+
+
+def index_rig(rig_name: str) -> None:
+    """Re-index one rig. Caller holds rigs_lock."""
+    info = rigs.get(rig_name)
+    new = rig_keys(info) if info else set()
+    old = rig_index_keys.get(rig_name, set())
+
+    for key in old - new:
+        names = rig_index.get(key)
+        if names:
+            names.discard(rig_name)
+            if not names:
+                del rig_index[key]
+
+    for key in new - old:
+        rig_index.setdefault(key, set()).add(rig_name)
+
+    if info:
+        if rig_name not in rig_index_keys:
+            insort(rig_names_sorted, rig_name)
+        rig_index_keys[rig_name] = new
+    elif rig_name in rig_index_keys:
+        del rig_index_keys[rig_name]
+        rig_names_sorted.pop(bisect_left(rig_names_sorted, rig_name))
+
+
+def clear_rig_index() -> None:
+    """Caller holds rigs_lock."""
+    rig_index.clear()
+    rig_index_keys.clear()
+    rig_names_sorted.clear()
+
+
+def project(value, path: List[str]):
+    """Follow a dotted path, mapping over lists (gpus.temp -> [t0, t1])."""
+    for i, part in enumerate(path):
+        if isinstance(value, list):
+            return [project(v, path[i:]) for v in value]
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+# ================================================================
+# COMMAND GROUPS (fan-out)
+# ================================================================
+# Every topic-safe rig tag doubles as an MQTT group. The server keeps a
+# retained rigcloud/<rig>/groups message per tagged rig; the agent
+# subscribes to rigcloud/group/<name>/cmd for each group listed there and
+# reports the groups it joined in its telemetry ("groups").
+#
+# plan_command() covers a selection with as few publishes as possible:
+# groups whose members are all inside the selection (greedy, biggest gain
+# first), then direct topics for whatever is left. The "all" topic is
+# never used for a selection: the rigs the server knows are not
+# necessarily every connected agent (after /reset, an eviction, or before
+# a rig first reports). A group only counts for the rigs
+# that reported joining it; a rig still catching up gets a direct publish
+# as well and the agent drops the duplicate by command id.
+
+GROUP_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def rig_groups(rig_name: str) -> List[str]:
+    return [t for t in rig_tags.get(rig_name, ()) if GROUP_NAME_RE.match(t)]
+
+
+def publish_rig_groups(rig_name: str) -> None:
+    mqtt_publish(
+        RIG_GROUPS_TOPIC.format(rig_name),
+        {"groups": rig_groups(rig_name)},
+        retain=True,
+    )
+
+
+def plan_command(targets) -> List[tuple]:
+    """Return [(topic, rigs reached)] covering every rig in targets."""
+    targets = set(targets)
+    remaining = set(targets)
+    plan = []
+
+    members: Dict[str, set] = {}   # group -> rigs tagged with or reporting it
+    joined: Dict[str, set] = {}    # group -> rigs known to be subscribed
+
+    for rig_name in list(rig_tags):
+        for g in rig_groups(rig_name):
+            members.setdefault(g, set()).add(rig_name)
+
+    with rigs_lock:
+        for rig_name, info in rigs.items():
+            for g in (info.get("data") or {}).get("groups") or ():
+                members.setdefault(g, set()).add(rig_name)
+                joined.setdefault(g, set()).add(rig_name)
+
+    candidates = {
+        g: joined[g] for g, m in members.items()
+        if g in joined and m <= targets
+    }
+
+    while remaining and candidates:
+        best = max(candidates, key=lambda g: len(candidates[g] & remaining))
+        gain = candidates.pop(best) & remaining
+        if len(gain) < 2:
+            break  # a direct publish is just as cheap
+
+        plan.append((CMD_GROUP_TOPIC.format(best), gain))
+        remaining -= gain
+
+    plan.extend((f"rigcloud/{r}/cmd", {r}) for r in sorted(remaining))
+    return plan
+
+# ================================================================
+# COMMAND TRACKING
+# ================================================================
+# Every POST /command is recorded with its target rigs; replies arriving
+# on rigcloud/<rig>/cmd_response are collected by id with the return code,
+# output and time since dispatch. GET /command/{id} (or POST /command with
+# "wait") reads the record, and per-rig replies are pushed only to the
+# WebSocket client that sent the command. Records live on the event loop
+# only, so they need no lock. The oldest are dropped past COMMAND_MAX or
+# after COMMAND_TTL seconds.
+
+COMMAND_TTL = float(os.getenv("COMMAND_TTL", "3600"))
+COMMAND_MAX = int(os.getenv("COMMAND_MAX", "500"))
+COMMAND_WAIT_MAX = 120.0  # seconds a POST /command may block
+
+
+class CommandRecord:
+    __slots__ = ("id", "command", "targets", "topics", "created", "client",
+                 "results", "done")
+
+    def __init__(self, cmd_id: str, command: str, targets, topics, client):
+        self.id = cmd_id
+        self.command = command
+        self.targets = set(targets)
+        self.topics = topics
+        self.created = time.time()
+        self.client = client          # originating WS client id, if any
+        self.results: Dict[str, dict] = {}
+        self.done = asyncio.Event()
+
+    def pending(self) -> List[str]:
+        return sorted(self.targets - self.results.keys())
+
+    def view(self) -> dict:
+        pending = self.pending()
+        return {
+            "id": self.id,
+            "command": self.command,
+            "status": "pending" if pending else "complete",
+            "created": self.created,
+            "topics": self.topics,
+            "expected": len(self.targets),
+            "received": len(self.targets) - len(pending),
+            "pending": pending,
+            "results": self.results,
+        }
+
+
+commands: Dict[str, CommandRecord] = {}
+
+
+def command_wait(value) -> float:
+    """Long-poll seconds from a request, clamped to 0..COMMAND_WAIT_MAX."""
+    try:
+        wait = float(value or 0)
+    except (TypeError, ValueError):
+        raise HTTPException(400, f"Invalid wait: {value!r}")
+    if math.isnan(wait):
+        raise HTTPException(400, f"Invalid wait: {value!r}")
+    return max(0.0, min(wait, COMMAND_WAIT_MAX))
+
+
+def track_command(rec: CommandRecord) -> None:
+    commands[rec.id] = rec
+
+    cutoff = time.time() - COMMAND_TTL
+    while commands:
+        oldest = next(iter(commands.values()))
+        if len(commands) <= COMMAND_MAX and oldest.created >= cutoff:
+            break
+        del commands[oldest.id]
+
+
+async def handle_cmd_response(resp: dict) -> None:
+    rec = commands.get(resp.get("id"))
+    rig_name = resp.get("rig")
+
+    if not rec or not rig_name:
+        return  # untracked (refresh, other server, expired)
+
+    rec.results[rig_name] = {
+        "returncode": resp.get("returncode"),
+        "stdout": resp.get("stdout", ""),
+        "stderr": resp.get("stderr", ""),
+        "timestamp": resp.get("timestamp"),
+        "elapsed": round(time.time() - rec.created, 3),
+    }
+
+    pending = rec.pending()
+    if not pending:
+        rec.done.set()
+
+    ws = ws_clients.get(rec.client) if rec.client else None
+    if ws is None:
+        return
+
+    try:
+        await ws.send_json({
+            "cmd_response": resp,
+            "progress": {
+                "expected": len(rec.targets),
+                "received": len(rec.targets) - len(pending),
+            },
+        })
+    except Exception:
+        pass
+
+# ================================================================
+# WEBSOCKET SUBSCRIPTIONS
+# ================================================================
+# A client can narrow what it receives by sending, on the same socket:
+#   {"type": "subscribe", "rigs": [...] | "*", "fields": [...] | "*",
+#    "interval": 30}
+#   {"type": "unsubscribe", "rigs": [...]}   (no rigs: stop rig updates)
+# Keys left out keep their current value. A new socket gets every rig,
+# whole records, on every push (interval 0) - what the dashboard uses.
+# fields are dotted paths as for GET /rigs. Each push encodes one message
+# per distinct subscription, not per client.
+
+WS_MAX_INTERVAL = 300.0  # seconds
+
+
+class WsSubscription:
+    __slots__ = ("rigs", "fields", "interval", "last_sent")
+
+    def __init__(self):
+        self.rigs: set | None = None                  # None = every rig
+        self.fields: List[List[str]] | None = None    # None = whole record
+        self.interval = 0.0
+        self.last_sent = 0.0
+
+    def update(self, msg: dict) -> None:
+        kind = msg.get("type")
+        names = msg.get("rigs")
+
+        if kind == "subscribe":
+            if names == "*":
+                self.rigs = None
+            elif names is not None:
+                self.rigs = (self.rigs or set()) | set(names)
+
+            fields = msg.get("fields")
+            if fields == "*" or fields == []:
+                self.fields = None
+            elif fields is not None:
+                self.fields = [f.split(".") for f in fields if f]
+
+            if "interval" in msg:
+                self.interval = min(max(float(msg["interval"]), 0.0), WS_MAX_INTERVAL)
+
+        elif kind == "unsubscribe":
+            if names is None or names == "*":
+                self.rigs = set()
+            else:
+                if self.rigs is None:
+                    with rigs_lock:
+                        self.rigs = set(rigs)
+                self.rigs -= set(names)
+
+        else:
+            raise ValueError(f"unknown message type {kind!r}")
+
+    def key(self) -> tuple:
+        return (
+            frozenset(self.rigs) if self.rigs is not None else None,
+            tuple(map(tuple, self.fields)) if self.fields else None,
+        )
+
+    def render(self, snapshot: dict) -> dict:
+        names = snapshot if self.rigs is None else (self.rigs & snapshot.keys())
+
+        if not self.fields:
+            return {name: snapshot[name] for name in names}
+
+        return {
+            name: {".".join(p): project(snapshot[name], p) for p in self.fields}
+            for name in names
+        }
+
+    def view(self) -> dict:
+        return {
+            "rigs": sorted(self.rigs) if self.rigs is not None else "*",
+            "fields": [".".join(p) for p in self.fields] if self.fields else "*",
+            "interval": self.interval,
+        }
+
+
+ws_subscriptions: Dict[WebSocket, WsSubscription] = {}
+
+
+async def send_rigs_to_clients(clients, snapshot: dict, force: bool = False) -> list:
+    """Send each client its view of snapshot; returns sockets that failed."""
+    now = time.time()
+    fleet = fleet_view()
+    encoded: Dict[tuple, str] = {}
+    stale = []
+
+    for ws in clients:
+        sub = ws_subscriptions.get(ws)
+        if sub is None:
+            continue
+        if sub.rigs is not None and not sub.rigs:
+            continue  # unsubscribed from everything
+        if not force and now - sub.last_sent < sub.interval:
+            continue
+
+        key = sub.key()
+        text = encoded.get(key)
+        if text is None:
+            text = encoded[key] = json.dumps(
+                {"rigs": sub.render(snapshot), "fleet": fleet},
+                separators=(",", ":"),
+                ensure_ascii=False,
+            )
+
+        try:
+            await ws.send_text(text)
+            sub.last_sent = now
+        except Exception:
+            stale.append(ws)
+
+    return stale
+
+
+async def send_offline_to_clients(names: List[str]) -> None:
+    """Tell each client which of its rigs just went offline."""
+    async with clients_lock:
+        clients = list(connected_clients)
+
+    fleet = fleet_view()
+
+    for ws in clients:
+        sub = ws_subscriptions.get(ws)
+        if sub is None:
+            continue
+
+        mine = names if sub.rigs is None else [n for n in names if n in sub.rigs]
+        if not mine:
+            continue
+
+        try:
+            await ws.send_json({"offline": mine, "fleet": fleet})
+        except Exception:
+            pass
+
+# ================================================================
+# OFFLINE DEADLINES
+# ================================================================
+# Each record gives its rig a deadline (liveness_deadline(): last
+# heartbeat + CHECK_TIMEOUT, or for rigs that never answer a check last
+# telemetry + REFRESH_TIMEOUT) on a min-heap. offline_watch_loop() sleeps until the
+# earliest one, so a rig goes offline when it is due instead of on the
+# next broadcast tick, and only the rigs that changed are pushed.
+# Entries superseded by a newer record stay in the heap and are skipped
+# when popped (offline_deadline holds each rig's current deadline).
+# Heap and map are guarded by rigs_lock.
+
+offline_heap: List[tuple] = []              # (deadline, rig)
+offline_deadline: Dict[str, float] = {}     # rig -> current deadline
+offline_wake: asyncio.Event | None = None
+offline_task: asyncio.Task | None = None
+
+
+def schedule_offline(rig_name: str, record: dict) -> None:
+    # caller holds rigs_lock
+    if INGEST_SERVER:
+        return  # the web workers track liveness themselves
+
+    if not record.get("online"):
+        offline_deadline.pop(rig_name, None)
+        return
+
+    # presence rigs too: the will only fires when an agent drops off
+    # uncleanly, the heartbeat / telemetry deadline is the fallback
+
+    deadline = liveness_deadline(record)
+    offline_deadline[rig_name] = deadline
+    heapq.heappush(offline_heap, (deadline, rig_name))
+
+    # only an earlier head needs to wake the watcher
+    if offline_heap[0] == (deadline, rig_name) and offline_wake and main_loop:
+        main_loop.call_soon_threadsafe(offline_wake.set)
+
+
+def liveness_deadline(record: dict) -> float:
+    if "seen" in record:
+        return record["seen"] + CHECK_TIMEOUT
+    # no heartbeats from this rig: telemetry is its only sign of life
+    return record.get("updated", 0) + max(REFRESH_TIMEOUT, 2 * TELEMETRY_INTERVAL)
+
+
+def record_is_live(record: dict, now: float) -> bool:
+    if record.get("presence") is False:
+        return False  # last will / shutdown
+    return now <= liveness_deadline(record)
+
+
+def clear_offline_deadlines() -> None:
+    # caller holds rigs_lock
+    offline_heap.clear()
+    offline_deadline.clear()
+
+
+async def expire_offline(now: float) -> None:
+    global checkpoint_dirty
+    went_offline = []
+
+    with rigs_lock:
+        while offline_heap and offline_heap[0][0] <= now:
+            deadline, rig_name = heapq.heappop(offline_heap)
+            if offline_deadline.get(rig_name) != deadline:
+                continue  # superseded by a newer record
+
+            del offline_deadline[rig_name]
+            info = rigs.get(rig_name)
+            if info and info.get("online"):
+                info["online"] = False
+                index_rig(rig_name)
+                went_offline.append(rig_name)
+
+    if not went_offline:
+        return
+
+    checkpoint_dirty = True
+    for rig_name in went_offline:
+        fleet_update(rig_name, None)
+
+    log(f"[Offline] {', '.join(went_offline)}")
+    await send_offline_to_clients(went_offline)
+
+
+async def offline_watch_loop() -> None:
+    while True:
+        offline_wake.clear()
+
+        with rigs_lock:
+            head = offline_heap[0][0] if offline_heap else None
+
+        timeout = None if head is None else max(head - time.time(), 0)
+        try:
+            await asyncio.wait_for(offline_wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        try:
+            await expire_offline(time.time())
+        except Exception as e:
+            log(f"[Offline] Error: {e}")
+
+# ================================================================
+# RIG PRESENCE (retained, last will)
+# ================================================================
+# Agents keep a retained message on rigcloud/<rig>/presence:
+#   {"rig", "state": "online", "timestamp", "summary": {...}}
+# refreshed after every status, with a last will of
+#   {"rig", "state": "offline"}
+# that the broker publishes (retained) when the agent drops off; a
+# stopping agent publishes the same itself. Being retained, all of them
+# arrive right after we subscribe, so a cold server knows every rig and
+# its row summary without asking anyone. An offline presence marks the
+# rig offline at once; an online one ("presence": true in the record)
+# still keeps its heartbeat / telemetry deadline, for agents that vanish
+# without a will reaching us.
+
+def apply_presence(msg: dict, now: float) -> None:
+    rig_name = msg.get("rig")
+    if not rig_name:
+        return
+
+    online = msg.get("state") == "online"
+
+    with rigs_lock:
+        current = rigs.get(rig_name)
+
+    data = dict(current["data"]) if current else {}
+    timestamp = current.get("timestamp", 0) if current else 0
+
+    # summary only overrides older (or checkpointed) telemetry
+    summary_ts = msg.get("timestamp") or int(now)
+    if online and (summary_ts >= timestamp or current.get("stale")):
+        data.update(msg.get("summary") or {})
+        timestamp = summary_ts
+
+    record = {
+        "timestamp": timestamp,
+        "updated": now,
+        "online": online,
+        "presence": online,
+        "data": data,
+    }
+    if current and "seen" in current:
+        record["seen"] = current["seen"]  # keep the heartbeat deadline
+    if current and current.get("stale"):
+        # checkpoint data stays out of fleet totals / indexes and the
+        # paced stale refresh still asks the rig for a full status
+        record["stale"] = True
+    apply_rig_record(rig_name, record, history=False)
+
+    if INGEST_SERVER:
+        ingest_broadcast({"op": "rig", "rig": rig_name, "record": record, "history": False})
+
+    if not online and current and current.get("online"):
+        log(f"[Presence] {rig_name} offline (last will)")
+        if main_loop:
+            main_loop.call_soon_threadsafe(
+                lambda: asyncio.create_task(send_offline_to_clients([rig_name]))
+            )
+    else:
+        schedule_ws_push(now)
+
+# ================================================================
+# HEARTBEATS (two-tier liveness)
+# ================================================================
+# While the dashboard is open, liveness and telemetry are asked for
+# separately. Every CHECK_INTERVAL seconds rigcloud/all/check gets a tiny
+# {"type": "check"} reply from each agent (no nvidia-smi, no docker). A
+# rig that answers has "seen" in its record and is judged by it: offline
+# CHECK_TIMEOUT after its last reply. Full telemetry ("refresh") is asked
+# for at the viewers' pace (telemetry_plan()): every TELEMETRY_INTERVAL
+# for open tabs, slower when every viewer is a background tab, and only
+# for rigs some viewer subscribed to.
+
+CHECK_INTERVAL = float(os.getenv("CHECK_INTERVAL", "5"))
+CHECK_TIMEOUT = 3 * CHECK_INTERVAL
+TELEMETRY_INTERVAL = float(os.getenv("TELEMETRY_INTERVAL", "30"))
+
+
+def apply_heartbeat(rig_name: str, seen: float) -> None:
+    with rigs_lock:
+        current = rigs.get(rig_name)
+        if current is not None:
+            if current.get("seen", 0) >= seen:
+                return
+            record = {**current, "seen": seen, "online": True}
+            rigs[rig_name] = record
+            if not current.get("online"):
+                index_rig(rig_name)
+            schedule_offline(rig_name, record)
+
+    if current is None:
+        # first sign of this rig: known (and online) before any telemetry
+        record = {"timestamp": int(seen), "updated": seen, "seen": seen, "online": True, "data": {}}
+        apply_rig_record(rig_name, record, history=False)
+    elif current.get("online"):
+        return
+    else:
+        fleet_update(rig_name, live_data(record))
+
+    log(f"[Heartbeat] {rig_name} online")
+    schedule_ws_push(time.time())
+
+
+def telemetry_plan() -> tuple:
+    """(interval, rigs) for full telemetry; rigs None = all, interval None = nobody watching."""
+    interval = None
+    targets: set = set()
+    everyone = False
+
+    for sub in list(ws_subscriptions.values()):
+        if sub.rigs is not None and not sub.rigs:
+            continue  # unsubscribed from everything
+
+        wanted = max(TELEMETRY_INTERVAL, sub.interval)
+        interval = wanted if interval is None else min(interval, wanted)
+
+        if sub.rigs is None:
+            everyone = True
+        else:
+            targets |= sub.rigs
+
+    return interval, None if everyone else targets
+
+
+def request_telemetry(targets) -> None:
+    payload = {
+        "id": f"refresh-{int(time.time())}",
+        "command": "refresh"
+    }
+
+    if targets is None:
+        mqtt_publish(CMD_ALL_TOPIC, payload)
+        log("[MQTT] Refresh requested")
+        return
+
+    # same id on every topic: rigs reached twice run it once
+    for topic, _ in plan_command(targets):
+        mqtt_publish(topic, payload)
+    log(f"[MQTT] Refresh requested for {len(targets)} rigs")
+
+
+async def heartbeat_loop():
+    while True:
+        mqtt_publish(CHECK_ALL_TOPIC, {"id": f"check-{int(time.time())}"})
+        await asyncio.sleep(CHECK_INTERVAL)
+
+# ================================================================
+# BROADCAST LOOP
+# ================================================================
+
+async def broadcast_loop():
+    log("[Broadcast] Loop started")
+    global last_refresh_ts
+
+    heartbeats = asyncio.create_task(heartbeat_loop())
+
+    try:
+        while True:
+            await asyncio.sleep(BROADCAST_INTERVAL)
+
+            # ---- hard stop check (sleep may have completed after stop) ----
+            if broadcast_stop.is_set():
+                break
+
+            # ---- ensure clients still exist ----
+            async with clients_lock:
+                if not connected_clients:
+                    continue
+
+            now = time.time()
+
+            # ---- full telemetry at the viewers' pace ----
+            interval, targets = telemetry_plan()
+            if interval is not None and now - last_refresh_ts >= interval:
+                request_telemetry(targets)
+                last_refresh_ts = now
+
+            # ---- SNAPSHOT BUILD (liveness is kept by offline_watch_loop) ----
+            with rigs_lock:
+                snapshot = dict(rigs)
+            with known_rigs_lock:
+                missing = known_rigs - snapshot.keys()
+
+            for rig in missing:
+                # rig known but currently offline with no data
+                snapshot[rig] = {
+                    "timestamp": 0,
+                    "updated": 0,
+                    "online": False,
+                    "data": {},
+                }
+
+            if not snapshot:
+                continue
+
+            async with clients_lock:
+                clients = list(connected_clients)
+
+            if not clients:
+                continue
+
+            stale = await send_rigs_to_clients(clients, snapshot)
+
+            if stale:
+                async with clients_lock:
+                    for ws in stale:
+                        if ws in connected_clients:
+                            connected_clients.remove(ws)
+
+    finally:
+        heartbeats.cancel()
+        log("[Broadcast] Loop stopped")
+
+# ================================================================
+# HTTP CACHING / COMPRESSION
+# ================================================================
+# Static files are read and compressed (gzip, plus brotli when the
+# module is installed) once, then re-read only if their mtime changes.
+# index.html links assets as ?v=<content hash>; those URLs are cached
+# for a year, everything else revalidates with ETag / If-None-Match.
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml", "image/x-icon")
+COMPRESS_MIN_SIZE = 1024
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+static_assets: Dict[str, "StaticAsset"] = {}
+static_assets_lock = threading.Lock()
+
+
+class StaticAsset:
+    __slots__ = ("mtime", "media_type", "etag", "hash", "variants")
+
+    def __init__(self, body: bytes, mtime: float, media_type: str):
+        self.mtime = mtime
+        self.media_type = media_type
+        self.hash = hashlib.sha256(body).hexdigest()[:12]
+        self.etag = f'"{self.hash}"'
+        self.variants = {"identity": body}
+
+        if len(body) >= COMPRESS_MIN_SIZE and media_type.startswith(COMPRESSIBLE_TYPES):
+            self.variants["gzip"] = gzip.compress(body, 9)
+            if brotli:
+                self.variants["br"] = brotli.compress(body)
+
+
+def accepted_encodings(request: Request) -> set:
+    encodings = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            encodings.add(name.lower())
+    return encodings
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return header == "*" or etag in (t.strip().removeprefix("W/") for t in header.split(","))
+
+
+def load_static_asset(rel: str) -> StaticAsset | None:
+    path = (STATIC_DIR / rel).resolve()
+    if STATIC_DIR not in path.parents or not path.is_file():
+        return None
+
+    mtime = path.stat().st_mtime
+    if rel == "index.html":
+        # the page embeds other assets' hashes, so it changes with them
+        mtime = max([mtime] + [p.stat().st_mtime for p in STATIC_DIR.rglob("*") if p.is_file()])
+
+    with static_assets_lock:
+        asset = static_assets.get(rel)
+        if asset and asset.mtime == mtime:
+            return asset
+
+    body = path.read_bytes()
+    if rel == "index.html":
+        body = hash_static_urls(body)
+
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    asset = StaticAsset(body, mtime, media_type)
+
+    with static_assets_lock:
+        static_assets[rel] = asset
+    return asset
+
+
+def hash_static_urls(html: bytes) -> bytes:
+    """Append ?v=<hash> to ./static/... links so they can be cached forever."""
+    text = html.decode("utf-8")
+
+    for attr in ("href", "src"):
+        start = 0
+        marker = f'{attr}="./static/'
+        while (i := text.find(marker, start)) != -1:
+            j = text.index('"', i + len(marker))
+            rel = text[i + len(marker):j]
+            start = j
+
+            if "?" in rel:
+                continue
+
+            asset = load_static_asset(rel)
+            if asset:
+                text = f"{text[:j]}?v={asset.hash}{text[j:]}"
+
+    return text.encode("utf-8")
+
+
+def asset_response(request: Request, asset: StaticAsset, cache_control: str) -> Response:
+    headers = {
+        "ETag": asset.etag,
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+
+    if etag_matches(request, asset.etag):
+        return Response(status_code=304, headers=headers)
+
+    accepted = accepted_encodings(request)
+    for encoding in ("br", "gzip"):
+        if encoding in asset.variants and encoding in accepted:
+            headers["Content-Encoding"] = encoding
+            return Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
+
+    return Response(asset.variants["identity"], media_type=asset.media_type, headers=headers)
+
+
+def json_default(o):
+    # DynamoDB numbers come back as Decimal
+    if isinstance(o, Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def conditional_json(request: Request, payload, etag: str | None = None, headers: dict | None = None) -> Response:
+    """
+    JSON response with an ETag, 304 on If-None-Match and gzip when large.
+    Pass etag when the caller already has a version for the payload.
+    """
+    headers = {**(headers or {}), "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+    if etag and etag_matches(request, etag):
+        headers["ETag"] = etag
+        return Response(status_code=304, headers=headers)
+
+    body = json.dumps(payload, separators=(",", ":"), default=json_default).encode("utf-8")
+    etag = etag or '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+    headers["ETag"] = etag
+
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    if len(body) >= COMPRESS_MIN_SIZE and "gzip" in accepted_encodings(request):
+        body = gzip.compress(body, 5)
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(body, media_type="application/json", headers=headers)
+
+# ================================================================
+# INITIAL PAGE STATE
+# ================================================================
+# serve_root() inlines the app config and the current rigs snapshot
+# into index.html, so the table can be drawn without waiting for
+# /api/config and the first WebSocket snapshot:
+#   <script id="initial-config" type="application/json">{...}</script>
+#   <script id="initial-rigs" type="application/json">{"rigs", "fleet"}</script>
+
+def app_config() -> dict:
+    return {"basePath": BASE_PATH, "telemetryInterval": TELEMETRY_INTERVAL}
+
+
+def inline_json(element_id: str, payload) -> str:
+    text = json.dumps(payload, separators=(",", ":"), default=json_default, ensure_ascii=False)
+    # "</script>" inside a string must not end the element
+    text = text.replace("</", "<\\/")
+    return f'<script id="{element_id}" type="application/json">{text}</script>\n'
+
+
+def index_with_state(request: Request, index: StaticAsset) -> Response:
+    with rigs_lock:
+        snapshot = dict(rigs)
+
+    state = (
+        inline_json("initial-config", app_config())
+        + inline_json("initial-rigs", {"rigs": snapshot, "fleet": fleet_view()})
+    )
+
+    html = index.variants["identity"].decode("utf-8")
+    html = html.replace("</head>", state + "</head>", 1)
+    body = html.encode("utf-8")
+
+    # changes with every update, so never reused without asking
+    headers = {"Cache-Control": "no-store", "Vary": "Accept-Encoding"}
+    if len(body) >= COMPRESS_MIN_SIZE and "gzip" in accepted_encodings(request):
+        body = gzip.compress(body, 5)
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(body, media_type="text/html", headers=headers)
+
+# ================================================================
+# HTTP ROUTES
+# ================================================================
+
+@router.get("/")
+def serve_root(request: Request):
+    index = load_static_asset("index.html")
+    if not index:
+        return {"error": "static/index.html missing in container"}
+    return index_with_state(request, index)
+
+@router.get("/static/{path:path}")
+def serve_static(path: str, request: Request):
+    asset = load_static_asset(path)
+    if not asset:
+        raise HTTPException(404, "Not Found")
+
+    immutable = request.query_params.get("v") == asset.hash
+    return asset_response(request, asset, IMMUTABLE_CACHE if immutable else "no-cache")
+
+@router.get("/rigs")
+def get_rigs(
+    request: Request,
+    fields: str = "",
+    online: bool | None = None,
+    miner: str = "",
+    gpu: str = "",
+    driver: str = "",
+    algorithm: str = "",
+    limit: int = 0,
+    cursor: str = "",
+):
+    """
+    Return latest rigs snapshot (debug/API).
+
+    Without parameters this is the full snapshot. Optional:
+      fields    comma separated dotted paths into the payload, e.g.
+                online,data.cpu_temp,data.gpus.temp
+      online / miner / gpu / driver / algorithm
+                filters (comma separated values match any, case-insensitive)
+      limit / cursor
+                page size and the next_cursor of the previous page
+    """
+    filters = {
+        "miner": miner, "gpu": gpu, "driver": driver, "algorithm": algorithm,
+    }
+    filters = {
+        f: {v.strip().lower() for v in vals.split(",") if v.strip()}
+        for f, vals in filters.items() if vals
+    }
+    if online is not None:
+        filters["online"] = {"true" if online else "false"}
+
+    paths = [f.split(".") for f in fields.split(",") if f]
+
+    if not (filters or paths or limit or cursor):
+        with rigs_lock:
+            snapshot = dict(rigs)
+        # encoded outside the lock: ingest and expiry keep going
+        return conditional_json(request, {"rigs": snapshot})
+
+    with rigs_lock:
+        # ---- candidate set from the indexes, smallest first ----
+        matched = None
+        sets = []
+        for f, values in filters.items():
+            union = set()
+            for v in values:
+                union |= rig_index.get((f, v), set())
+            sets.append(union)
+
+        for names in sorted(sets, key=len):
+            matched = names if matched is None else matched & names
+            if not matched:
+                break
+
+        if matched is None:
+            names = rig_names_sorted[bisect_right(rig_names_sorted, cursor):] if cursor else rig_names_sorted
+            total = len(rig_names_sorted)
+        else:
+            total = len(matched)
+            names = sorted(n for n in matched if n > cursor)
+
+        page = names[:limit] if limit > 0 else names
+        next_cursor = page[-1] if limit > 0 and len(names) > limit else None
+
+        out = {}
+        for name in page:
+            info = rigs[name]
+            if paths:
+                out[name] = {".".join(p): project(info, p) for p in paths}
+            else:
+                out[name] = info
+
+    return conditional_json(request, {"rigs": out, "total": total, "next_cursor": next_cursor})
+
+@router.get("/api/history")
+def get_history(
+    rigs: str = "",
+    metrics: str = "",
+    res: str = "1m",
+    since: int = 0,
+    until: int = 0,
+):
+    """
+    Columnar metric history.
+
+    rigs / metrics are comma separated (empty = all). res is raw, 1m, 15m
+    or (with the SQLite store) 1h. raw series are {"t": [...], "v": [...]},
+    bucketed series are {"start": ts, "step": seconds, "v": [...]} with
+    null for gaps. Ranges older than the in-memory rings come from disk.
+    """
+    valid = set(HISTORY_STEPS) | {"raw"}
+    if HISTORY_DB:
+        valid |= set(HISTORY_DB_TABLES)
+
+    if res not in valid:
+        raise HTTPException(400, f"Invalid res: {res}")
+
+    until = until or int(time.time())
+    since = since or until - 86400
+
+    rig_filter = {r for r in rigs.split(",") if r}
+    metric_filter = {m for m in metrics.split(",") if m}
+
+    out, covered = {}, False
+    if res in HISTORY_STEPS or res == "raw":
+        out, covered = history_mem_query(rig_filter, metric_filter, res, since, until)
+
+    if not covered and HISTORY_DB:
+        out = history_db_query(rig_filter, metric_filter, res, since, until)
+
+    return {"res": res, "since": since, "until": until, "rigs": out}
+
+@router.get("/api/fleet")
+def get_fleet():
+    """Fleet totals per algorithm, miner and rig tag."""
+    return fleet_view()
+
+@router.get("/api/tags")
+def get_rig_tags():
+    return rig_tags
+
+@router.put("/api/tags/{rig_name}")
+def put_rig_tags(rig_name: str, payload: RigTagsIn):
+    tags = sorted({t.strip() for t in payload.tags if t.strip()})
+
+    set_rig_tags(rig_name, tags)
+    save_rig_tags()
+    publish_rig_groups(rig_name)
+    ingest_relay({"op": "tags", "rig": rig_name, "tags": tags})
+
+    log(f"[Tags] {rig_name} -> {tags}")
+    return {"rig": rig_name, "tags": tags}
+
+@router.post("/refresh")
+def refresh_all():
+    mqtt_publish(
+        CMD_ALL_TOPIC,
+        {
+            "id": f"refresh-{int(time.time())}",
+            "command": "refresh"
+        }
+    )
+    return {"status": "refresh sent"}
+
+def clear_live_state(keep_history: bool = False) -> None:
+    global checkpoint_dirty
+    checkpoint_dirty = True
+
+    with known_rigs_lock:
+        known_rigs.clear()
+
+    with rigs_lock:
+        rigs.clear()
+        rig_footprint.clear()
+        pruned_data.clear()
+        clear_rig_index()
+        clear_offline_deadlines()
+
+    if not keep_history:
+        with history_lock:
+            history.clear()
+
+    fleet_clear()
+
+@router.post("/reset")
+def reset_known_rigs():
+    global last_refresh_ts
+    last_refresh_ts = time.time()
+
+    clear_live_state()
+    ingest_relay({"op": "reset"})
+
+    mqtt_publish(
+        CMD_ALL_TOPIC,
+        {
+            "id": f"refresh-{int(time.time())}",
+            "command": "refresh"
+        }
+    )
+
+    log("[Reset] Cleared known rigs and telemetry (user request)")
+    return {"status": "reset complete"}
+
+@router.post("/command")
+async def send_command(payload: dict):
+    rigs = payload.get("rigs", [])
+    command = payload.get("command")
+
+    if not command or not rigs:
+        return {"error": "missing rigs or command"}
+
+    # checked before anything is sent
+    wait = command_wait(payload.get("wait"))
+
+    # one id for the whole fan-out; the suffix keeps two web workers
+    # sending in the same millisecond apart
+    cmd_id = f"cmd-{time.time_ns() // 1_000_000}-{uuid.uuid4().hex[:6]}"
+
+    msg = {
+        "id": cmd_id,
+        "command": command
+    }
+
+    plan = plan_command(rigs)
+    rec = CommandRecord(cmd_id, command, rigs, [topic for topic, _ in plan],
+                        payload.get("client_id"))
+    track_command(rec)
+    ingest_relay({
+        "op": "command", "id": cmd_id, "command": command,
+        "targets": sorted(rec.targets), "topics": rec.topics,
+        "created": rec.created, "client": rec.client,
+    })
+
+    for topic, reached in plan:
+        mqtt_publish(topic, msg)
+        log(f"[CMD] Sent command to {topic} ({len(reached)} rigs): {command!r}")
+
+    # optional long-poll: hold the response until every rig replied
+    if wait > 0:
+        try:
+            await asyncio.wait_for(rec.done.wait(), wait)
+        except asyncio.TimeoutError:
+            pass
+        return rec.view()
+
+    return {
+        "status": "sent",
+        "id": cmd_id,
+        "rigs": rigs,
+        "expected": len(rec.targets),
+        "topics": rec.topics,
+    }
+
+@router.get("/command/{cmd_id}")
+async def get_command(cmd_id: str, wait: str = "0"):
+    rec = commands.get(cmd_id)
+    if not rec:
+        raise HTTPException(404, "Unknown or expired command id")
+
+    wait = command_wait(wait)
+    if wait > 0:
+        try:
+            await asyncio.wait_for(rec.done.wait(), wait)
+        except asyncio.TimeoutError:
+            pass
+
+    return rec.view()
+
+# ================================================================
+# FLIGHTSHEET CACHE (write-through)
+# ================================================================
+# Full copy of the flightsheet store keyed by (FlightsheetId, GpuId).
+# Loaded by a full scan on first use, updated in place by the PUT /
+# DELETE routes and re-scanned in the background every
+# FLIGHTSHEET_CACHE_TTL seconds to pick up edits from other servers.
+# The version increments on every change and is sent to the browser.
+
+FLIGHTSHEET_CACHE_TTL = float(os.getenv("FLIGHTSHEET_CACHE_TTL", "300"))
+
+flightsheet_cache: Dict[tuple, dict] | None = None
+flightsheet_cache_version = 0
+flightsheet_cache_lock = threading.Lock()
+
+flightsheet_store_task: asyncio.Task | None = None
+flightsheet_refresh_task: asyncio.Task | None = None
+
+
+def flightsheet_key(item: dict) -> tuple:
+    return item["FlightsheetId"], int(item["GpuId"])
+
+
+def refresh_flightsheet_cache() -> None:
+    global flightsheet_cache, flightsheet_cache_version
+
+    with flightsheet_cache_lock:
+        start_version = flightsheet_cache_version
+
+    fresh = {flightsheet_key(item): item for item in flightsheet_store.scan()}
+
+    with flightsheet_cache_lock:
+        if flightsheet_cache_version != start_version:
+            return  # a write landed during the scan, next refresh catches up
+
+        if fresh != flightsheet_cache:
+            flightsheet_cache = fresh
+            flightsheet_cache_version += 1
+            log(f"[FS CACHE] Loaded {len(fresh)} items (version {flightsheet_cache_version})")
+
+
+def get_flightsheet_cache() -> tuple:
+    """Return (version, items), loading the cache on first use."""
+    if flightsheet_cache is None:
+        refresh_flightsheet_cache()
+
+    with flightsheet_cache_lock:
+        version = flightsheet_cache_version
+        if flightsheet_cache is not None:
+            return version, list(flightsheet_cache.values())
+
+    # load raced with a write; serve this request straight from the table
+    return version, flightsheet_store.scan()
+
+
+def cache_put_flightsheet(flightsheet_id: str, items: List[dict]) -> int:
+    """Replace all cached rows of one flightsheet (items=[] deletes it)."""
+    global flightsheet_cache_version
+
+    with flightsheet_cache_lock:
+        if flightsheet_cache is not None:
+            for key in [k for k in flightsheet_cache if k[0] == flightsheet_id]:
+                del flightsheet_cache[key]
+            for item in items:
+                flightsheet_cache[flightsheet_key(item)] = item
+
+        flightsheet_cache_version += 1
+        return flightsheet_cache_version
+
+
+
+# ================================================================
+# FLIGHTSHEET STORE I/O (bounded executor + diff saves)
+# ================================================================
+# Store calls from request handlers go through a small dedicated pool,
+# so slow DynamoDB round trips queue here instead of occupying the
+# threadpool FastAPI uses for every other sync endpoint.
+
+FLIGHTSHEET_MAX_WORKERS = int(os.getenv("FLIGHTSHEET_MAX_WORKERS", "4"))
+
+store_executor = ThreadPoolExecutor(max_workers=FLIGHTSHEET_MAX_WORKERS, thread_name_prefix="fs-store")
+
+
+async def run_store(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(store_executor, fn, *args)
+
+
+def save_flightsheet_diff(flightsheet_id: str, items: List[dict]) -> tuple:
+    """
+    Write only rows that changed and delete rows that are gone.
+    Returns (deleted, written, resulting rows).
+    """
+    # from the store, not the cache: rows may have been edited elsewhere
+    # (another server, the console) since the last cache refresh
+    stored = flightsheet_store.rows(flightsheet_id)
+    new = {item["GpuId"]: item for item in items}
+
+    puts = [
+        item for gpu, item in new.items()
+        if gpu not in stored
+        or stored[gpu].get("Key") != item["Key"]
+        or stored[gpu].get("Value") != item["Value"]
+    ]
+    deletes = [gpu for gpu in stored if gpu not in new]
+
+    # unchanged rows keep their stored UpdatedAt
+    changed = {item["GpuId"] for item in puts}
+    rows = [item if gpu in changed else stored[gpu] for gpu, item in new.items()]
+
+    if puts or deletes:
+        flightsheet_store.apply(flightsheet_id, puts, deletes)
+
+    return len(deletes), len(puts), rows
+
+
+async def flightsheet_refresh_loop():
+    while True:
+        await asyncio.sleep(FLIGHTSHEET_CACHE_TTL)
+        try:
+            await run_store(refresh_flightsheet_cache)
+        except Exception as e:
+            log(f"[FS CACHE] Refresh failed: {e}")
+
+
+async def flightsheet_store_startup():
+    """Connect DynamoDB in the background, then warm the cache."""
+    global flightsheet_store, flightsheet_store_status, flightsheet_refresh_task
+
+    while True:
+        try:
+            table = await run_store(init_dynamodb)
+            break
+        except Exception as e:
+            flightsheet_store_status = "unavailable"
+            log(f"[AWS] DynamoDB init failed: {e} — retrying in 30s")
+            await asyncio.sleep(30)
+
+    flightsheet_store = DynamoFlightsheetStore(table)
+    flightsheet_store_status = "ready"
+
+    # only DynamoDB can change behind our back (other servers / console)
+    flightsheet_refresh_task = asyncio.create_task(flightsheet_refresh_loop())
+
+    try:
+        await run_store(refresh_flightsheet_cache)
+    except Exception as e:
+        log(f"[FS CACHE] Initial load failed: {e}")
+
+
+def flightsheet_store_or_503() -> FlightsheetStore:
+    if flightsheet_store:
+        return flightsheet_store
+
+    if flightsheet_store_status == "warming_up":
+        raise HTTPException(503, "Flightsheets store warming up", headers={"Retry-After": "2"})
+    raise HTTPException(503, "Flightsheets store not available")
+
+# ================================================================
+# FLIGHTSHEETS API
+# ================================================================
+
+@router.get("/api/flightsheets")
+async def get_flightsheets(request: Request):
+    flightsheet_store_or_503()
+
+    try:
+        if flightsheet_cache is not None:
+            version, items = get_flightsheet_cache()
+        else:
+            version, items = await run_store(get_flightsheet_cache)
+
+        return conditional_json(
+            request,
+            items,
+            etag=f'"fs-{version}"',
+            headers={"X-Flightsheets-Version": str(version)},
+        )
+
+    except Exception as e:
+        log(f"[FS GET ERROR] Exception: {e}")
+        return []
+
+
+@router.put("/api/flightsheets/{flightsheet_id}")
+async def put_flightsheet(flightsheet_id: str, payload: FlightSheetPutIn):
+    log(f"[FS PUT] Saving flightsheet: {flightsheet_id}")
+
+    flightsheet_store_or_503()
+
+    now = int(time.time())
+
+    items = {}
+    for e in payload.entries:
+        items[int(e.gpu)] = {
+            "FlightsheetId": flightsheet_id,
+            "GpuId": int(e.gpu),
+            "Key": e.key.strip().upper(),
+            "Value": e.value,
+            "UpdatedAt": now,
+        }
+
+    try:
+        deleted, written, rows = await run_store(
+            save_flightsheet_diff, flightsheet_id, list(items.values())
+        )
+    except Exception as e:
+        log(f"[FS PUT ERROR] Error: {e}")
+        raise HTTPException(500, f"Failed to save flightsheet: {e}")
+
+    if written or deleted:
+        version = cache_put_flightsheet(flightsheet_id, rows)
+        ingest_relay({"op": "flightsheet", "id": flightsheet_id, "rows": rows})
+    else:
+        version = flightsheet_cache_version
+
+    log(f"[FS PUT] Saved {flightsheet_id}: {written} written, {deleted} deleted, "
+        f"{len(rows) - written} unchanged")
+
+    return {
+        "status": "ok",
+        "deleted": deleted,
+        "inserted": written,
+        "unchanged": len(rows) - written,
+        "version": version,
+    }
+
+
+@router.delete("/api/flightsheets/{flightsheet_id}")
+async def delete_flightsheet(flightsheet_id: str):
+    log(f"[FS DELETE] Deleting flightsheet: {flightsheet_id}")
+
+    flightsheet_store_or_503()
+
+    try:
+        deleted = await run_store(flightsheet_store.delete, flightsheet_id)
+        version = cache_put_flightsheet(flightsheet_id, [])
+        ingest_relay({"op": "flightsheet", "id": flightsheet_id, "rows": []})
+        return {
+            "status": "deleted",
+            "flightsheet_id": flightsheet_id,
+            "deleted_count": deleted,
+            "version": version,
+        }
+
+    except Exception as e:
+        log(f"[FS DELETE ERROR] Error: {e}")
+        raise HTTPException(500, f"Failed to delete flightsheet: {e}")
+
+# ================================================================
+# WEBSOCKET ENDPOINT
+# ================================================================
+
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+
+    # unique across web workers: the POST /command may land on another one
+    client_id = f"ws-{uuid.uuid4().hex}"
+
+    sub = WsSubscription()
+    ws_subscriptions[websocket] = sub
+
+    async with clients_lock:
+        connected_clients.append(websocket)
+        first_client = len(connected_clients) == 1
+    ws_clients[client_id] = websocket
+
+    log(f"[WebSocket] Client connected ({client_id})")
+
+    # sent back with POST /command so replies come to this tab only
+    await websocket.send_json({"client_id": client_id})
+
+    global broadcast_task, checkpoint_dirty
+    if first_client:
+        broadcast_stop.clear()
+        broadcast_task = asyncio.create_task(broadcast_loop())
+        mqtt_publish(
+            CMD_ALL_TOPIC,
+            {
+                "id": f"refresh-{int(time.time())}",
+                "command": "refresh"
+            }
+        )
+
+        log("[MQTT] Refresh requested (first WS client)")
+
+    with rigs_lock:
+        initial_snapshot = dict(rigs)
+    if initial_snapshot:
+        await websocket.send_json({"rigs": initial_snapshot, "fleet": fleet_view()})
+
+    try:
+        while True:
+            text = await websocket.receive_text()
+
+            try:
+                sub.update(json.loads(text))
+            except Exception as e:
+                await websocket.send_json({"error": f"Bad subscription message: {e}"})
+                continue
+
+            await websocket.send_json({"subscription": sub.view()})
+
+            # current state for the new view straight away
+            with rigs_lock:
+                snapshot = dict(rigs)
+            await send_rigs_to_clients([websocket], snapshot, force=True)
+
+    except WebSocketDisconnect:
+        log("[WebSocket] Client disconnected")
+    finally:
+        ws_clients.pop(client_id, None)
+        ws_subscriptions.pop(websocket, None)
+
+        async with clients_lock:
+            if websocket in connected_clients:
+                connected_clients.remove(websocket)
+
+            last_client = len(connected_clients) == 0
+
+        if last_client and broadcast_task:
+            broadcast_stop.set()
+            broadcast_task = None
+
+            with rigs_lock:
+                for rig, info in rigs.items():
+                    if info["data"]:
+                        pruned_data[rig] = info["data"]  # still checkpointed
+                    # new record: a checkpoint being written holds the old one
+                    rigs[rig] = {**info, "data": {}, "online": False}
+                    rig_footprint[rig] = sys.getsizeof(rigs[rig]["data"])
+                    index_rig(rig)
+                clear_offline_deadlines()
+
+            checkpoint_dirty = True
+            fleet_clear()
+
+            log("[Prune] Cleared live rig telemetry (preserved rig list)")
+
+# ================================================================
+# FASTAPI LIFESPAN
+# ================================================================
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global main_loop, broadcast_stop, broadcast_task
+    global flightsheet_store_task, flightsheet_refresh_task, ingest_client_task
+    global offline_wake, offline_task
+    main_loop = asyncio.get_running_loop()
+    broadcast_stop = asyncio.Event()
+    log("[Startup] Dashboard server starting")
+
+    offline_wake = asyncio.Event()
+    offline_task = asyncio.create_task(offline_watch_loop())
+
+    if RIGCLOUD_WORKER:
+        ingest_client_task = asyncio.create_task(ingest_client_loop())
+
+    if FLIGHTSHEET_BACKEND == "dynamodb":
+        flightsheet_store_task = asyncio.create_task(flightsheet_store_startup())
+
+    yield
+    log("[Shutdown] Dashboard server stopping")
+
+    for task in (flightsheet_store_task, flightsheet_refresh_task, ingest_client_task,
+                 offline_task):
+        if task:
+            task.cancel()
+    flightsheet_store_task = flightsheet_refresh_task = ingest_client_task = None
+    offline_task = None
+
+    if broadcast_stop:
+        broadcast_stop.set()
+    broadcast_task = None
+
+# ================================================================
+# FastAPI
+# ================================================================
+
+app = FastAPI(lifespan=lifespan)
+
+if MQTT_MODE == "local":
+    app.include_router(router, prefix=BASE_PATH)
+else:
+    app.include_router(router)
+
+# CORS (so dashboard can be opened from anywhere on LAN)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+@app.get("/favicon.ico", include_in_schema=False)
+async def favicon():
+    return FileResponse(STATIC_DIR / "favicon.ico", media_type="image/x-icon")
+
+@app.get("/api/config")
+def get_config(request: Request):
+    return conditional_json(request, app_config())
+
+# ================================================================
+# MQTT CALLBACKS
+# ================================================================
+def on_connect(client, userdata, flags, reason_code, properties):
+    if reason_code == 0:
+        log(f"[MQTT] Connected to {MQTT_BROKER}:{MQTT_PORT}")
+
+        if MQTT_SHARE_GROUP:
+            filters = [
+                f"$share/{MQTT_SHARE_GROUP}/rigcloud/+/status",
+                SYNC_TOPIC.format("+"),
+            ]
+            sync_request_full()
+        else:
+            filters = [MQTT_TOPIC_FILTER]
+
+        # command responses (every instance, few and small) and the
+        # retained presence of every rig, unless the filter covers them
+        for extra in (CMD_RESPONSE_FILTER, PRESENCE_FILTER):
+            if not mqtt.topic_matches_sub(filters[0], extra.replace("+", "rig")):
+                filters.append(extra)
+
+        for topic_filter in filters:
+            client.subscribe(topic_filter, qos=0)
+            log(f"[MQTT] Subscribed to {topic_filter}")
+
+        # (re)assert group membership for agents that connect later
+        for rig_name in list(rig_tags):
+            publish_rig_groups(rig_name)
+
+        # warm start: rigs loaded from the checkpoint, paced
+        start_stale_refresh()
+    else:
+        log(f"[MQTT] Connect failed with reason_code={reason_code}")
+
+# ---- topic router ----
+# Messages are dispatched on the last topic segment before anything is
+# decoded. Status payloads are filed raw in the mailbox; the other kinds
+# are decoded on decode_pool, never on the paho network thread. Topics
+# without a route (our own cmd/check publishes, group assignments) are
+# dropped undecoded.
+#
+# decode_pool is DECODE_WORKERS single-thread executors and a topic
+# always hashes to the same one, so one rig's presence changes (online,
+# then its last will) are applied in order.
+
+DECODE_WORKERS = max(1, int(os.getenv("DECODE_WORKERS", "2")))
+decode_pool = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"mqtt-decode-{i}")
+    for i in range(DECODE_WORKERS)
+]
+
+
+def route_status(topic: str, payload: bytes, now: float) -> None:
+    mailbox_put(topic, payload, now)  # decoded by the mailbox thread
+
+
+def route_sync(topic: str, payload: bytes, now: float) -> None:
+    apply_sync(json.loads(payload))
+
+
+def route_presence(topic: str, payload: bytes, now: float) -> None:
+    if payload:  # empty = retained message cleared
+        apply_presence(json.loads(payload), now)
+
+
+def route_cmd_response(topic: str, payload: bytes, now: float) -> None:
+    data = json.loads(payload)
+    log(f"[CMD_RESPONSE] {data.get('rig')} id={data.get('id')}")
+
+    if INGEST_SERVER:
+        ingest_broadcast({"op": "cmd_response", "data": data})
+
+    if main_loop:
+        main_loop.call_soon_threadsafe(
+            lambda: asyncio.create_task(
+                handle_cmd_response(data)
+            )
+        )
+
+
+# last topic segment -> (handler, decoded on decode_pool)
+TOPIC_ROUTES = {
+    "status": (route_status, False),
+    "presence": (route_presence, True),
+    "cmd_response": (route_cmd_response, True),
+}
+SYNC_ROUTE = (route_sync, True)
+
+
+def decode_run(handler, topic: str, payload: bytes, now: float) -> None:
+    try:
+        handler(topic, payload, now)
+    except Exception as e:
+        log(f"[MQTT] Error processing message on {topic}: {e}")
+
+
+def on_message(client, userdata, msg):
+    topic = msg.topic
+
+    if topic.startswith(SYNC_PREFIX):
+        route = SYNC_ROUTE
+    else:
+        route = TOPIC_ROUTES.get(topic.rpartition("/")[2])
+        if route is None:
+            return
+
+    handler, pooled = route
+    now = time.time()
+
+    if pooled:
+        decode_pool[hash(topic) % DECODE_WORKERS].submit(decode_run, handler, topic, msg.payload, now)
+    else:
+        decode_run(handler, topic, msg.payload, now)
+
+def apply_rig_record(rig_name: str, record: dict, history: bool = True,
+                     persist: bool = True) -> None:
+    apply_rig_records({rig_name: record}, history, persist)
+
+def apply_rig_records(records: Dict[str, dict], history: bool = True,
+                      persist: bool = True) -> None:
+    global checkpoint_dirty
+    checkpoint_dirty = True
+
+    # ---- compact before keeping (shared with workers / peers too) ----
+    sizes = {}
+    for rig_name, record in records.items():
+        record["data"], sizes[rig_name] = compact_payload(record["data"])
+
+    # ---- register rig identities ----
+    with known_rigs_lock:
+        known_rigs.update(records)
+
+    # ---- update live telemetry (one lock round for the batch) ----
+    with rigs_lock:
+        for rig_name, record in records.items():
+            rigs[rig_name] = record
+            rig_footprint[rig_name] = sizes[rig_name]
+            pruned_data.pop(rig_name, None)
+            index_rig(rig_name)
+            schedule_offline(rig_name, record)
+
+    for rig_name, record in records.items():
+        # ---- feed metric history ----
+        if history:
+            record_history(rig_name, record["data"], record["updated"], persist)
+
+        # ---- fleet aggregates ----
+        fleet_update(rig_name, live_data(record))
+
+def schedule_ws_push(now: float) -> None:
+    # ---- push snapshot to WS (debounced) ----
+    global last_ws_push
+    if connected_clients and now - last_ws_push >= WS_PUSH_MIN_INTERVAL:
+        last_ws_push = now
+        if main_loop:
+            main_loop.call_soon_threadsafe(
+                lambda: asyncio.create_task(push_snapshot_to_ws())
+            )
+
+def mqtt_publish(topic: str, payload: dict, retain: bool = False):
+    if RIGCLOUD_WORKER:
+        # only the ingest process holds an MQTT connection
+        ingest_send({"op": "publish", "topic": topic, "payload": payload, "retain": retain})
+        return
 
-def mqtt_publish(topic: str, payload: dict):
     try:
-        mqtt_client.publish(topic, json.dumps(payload), qos=0)
+        mqtt_client.publish(topic, json.dumps(payload), qos=0, retain=retain)
     except Exception as e:
         log(f"[MQTT] Publish error: {e}")
 
@@ -724,14 +2920,7 @@ async def push_snapshot_to_ws():
     if not clients:
         return
 
-    message = {"rigs": snapshot}
-
-    stale = []
-    for ws in clients:
-        try:
-            await ws.send_json(message)
-        except Exception:
-            stale.append(ws)
+    stale = await send_rigs_to_clients(clients, snapshot)
 
     if stale:
         async with clients_lock:
@@ -745,8 +2934,8 @@ def mqtt_thread_main():
     log(f"[MQTT] Mode={MQTT_MODE} Connecting to {MQTT_BROKER}:{MQTT_PORT} ...")
 
     mqtt_client = mqtt.Client(
-        client_id=f"rigcloud-dashboard-{os.getpid()}",
-        protocol=mqtt.MQTTv311,
+        client_id=f"rigcloud-dashboard-{INSTANCE_ID}",
+        protocol=mqtt.MQTTv5 if MQTT_SHARE_GROUP else mqtt.MQTTv311,
         callback_api_version=CallbackAPIVersion.VERSION2
     )
 
@@ -775,12 +2964,833 @@ def mqtt_thread_main():
             log(f"[MQTT] Error: {e} — retrying in 3s")
             time.sleep(3)
 
+# ================================================================
+# TELEMETRY MAILBOX (latest wins)
+# ================================================================
+# on_message() does not decode status messages on the paho thread. It
+# files the raw payload under its topic (one per rig) and returns.
+# mailbox_thread_main() wakes MAILBOX_BATCH_INTERVAL after the first
+# message, takes everything filed so far and applies it as one batch
+# (apply_rig_records(): one lock round, one WebSocket push).
+#
+# Per rig only the newest telemetry is decoded and applied; anything it
+# superseded is dropped undecoded. Check replies share the status topic,
+# so a rig's last MAILBOX_DEPTH payloads are kept and decoded newest
+# first until one is telemetry: a heartbeat filed after a status does not
+# hide it. Rigs beyond MAILBOX_MAX waiting in one batch are dropped.
+
+MAILBOX_BATCH_INTERVAL = float(os.getenv("MAILBOX_BATCH_INTERVAL", "0.05"))
+MAILBOX_MAX = int(os.getenv("MAILBOX_MAX", "20000"))
+MAILBOX_DEPTH = 4
+MAILBOX_LOG_INTERVAL = 60
+
+mailbox: Dict[str, List[tuple]] = {}    # topic -> [(arrived, raw payload)], oldest first
+mailbox_lock = threading.Lock()
+mailbox_wake = threading.Event()
+mailbox_stats = {"received": 0, "applied": 0, "superseded": 0, "dropped": 0}
+
+
+def mailbox_put(topic: str, payload: bytes, now: float) -> None:
+    with mailbox_lock:
+        mailbox_stats["received"] += 1
+
+        slot = mailbox.get(topic)
+        if slot is None:
+            if len(mailbox) >= MAILBOX_MAX:
+                mailbox_stats["dropped"] += 1
+                return
+            slot = mailbox[topic] = []
+
+        slot.append((now, payload))
+        if len(slot) > MAILBOX_DEPTH:
+            del slot[0]
+            mailbox_stats["superseded"] += 1
+
+    mailbox_wake.set()
+
+
+def mailbox_take(slot: List[tuple]):
+    """Newest telemetry (arrived, data) and newest heartbeat time in a slot."""
+    telemetry = None
+    seen = None
+    decoded = 0
+
+    for arrived, payload in reversed(slot):
+        decoded += 1
+        try:
+            data = json.loads(payload)
+        except ValueError as e:
+            log(f"[MQTT] Error processing message: {e}")
+            continue
+
+        if not isinstance(data, dict) or not data.get("rig"):
+            continue  # Ignore messages without a rig identity
+
+        if data.get("type") == "check":
+            seen = seen or (arrived, data["rig"])
+            continue
+
+        telemetry = (arrived, data)
+        break
+
+    return telemetry, seen, len(slot) - decoded
+
+
+def mailbox_drain() -> None:
+    with mailbox_lock:
+        batch = list(mailbox.values())
+        mailbox.clear()
+        mailbox_wake.clear()
+
+    if not batch:
+        return
+
+    latest: List[tuple] = []
+    heartbeats: List[tuple] = []
+    superseded = 0
+
+    for slot in batch:
+        telemetry, seen, skipped = mailbox_take(slot)
+        superseded += skipped
+
+        if seen:
+            heartbeats.append(seen)
+        if telemetry:
+            latest.append(telemetry)
+
+    records: Dict[str, dict] = {}
+
+    with rigs_lock:
+        for now, data in latest:
+            rig_name = data["rig"]
+            previous = rigs.get(rig_name)
+            if previous and previous.get("presence") is False and previous.get("updated", 0) > now:
+                # presence is decoded on decode_pool and can overtake a
+                # status filed before it: the last will (or shutdown)
+                # wins, an online presence summary never does
+                superseded += 1
+                continue
+
+            record = {
+                "timestamp": int(now),
+                "updated": now,
+                "online": True,
+                "data": data,
+            }
+
+            if previous and previous.get("presence"):
+                record["presence"] = True
+            if previous and "seen" in previous:
+                record["seen"] = now  # telemetry counts as a heartbeat too
+
+            records[rig_name] = record
+
+    with mailbox_lock:
+        mailbox_stats["applied"] += len(records)
+        mailbox_stats["superseded"] += superseded
+
+    if records:
+        apply_rig_records(records)
+
+        # ---- hand the updates to the web workers / other instances ----
+        for rig_name, record in records.items():
+            if INGEST_SERVER:
+                ingest_broadcast({"op": "rig", "rig": rig_name, "record": record})
+            if MQTT_SHARE_GROUP:
+                sync_queue(rig_name, record)
+
+    # ---- heartbeats (replies to rigcloud/all/check): liveness only ----
+    for now, rig_name in heartbeats:
+        apply_heartbeat(rig_name, now)
+        if INGEST_SERVER:
+            ingest_broadcast({"op": "seen", "rig": rig_name, "t": now})
+        if MQTT_SHARE_GROUP:
+            sync_queue_seen(rig_name, now)
+
+    if records:
+        schedule_ws_push(time.time())
+
+
+def mailbox_thread_main() -> None:
+    last_log = time.time()
+    logged = dict(mailbox_stats)
+
+    while True:
+        mailbox_wake.wait(MAILBOX_LOG_INTERVAL)
+        time.sleep(MAILBOX_BATCH_INTERVAL)  # let the burst collect
+
+        try:
+            mailbox_drain()
+        except Exception as e:
+            log(f"[Mailbox] Error applying batch: {e}")
+
+        now = time.time()
+        if now - last_log < MAILBOX_LOG_INTERVAL:
+            continue
+
+        with mailbox_lock:
+            stats = dict(mailbox_stats)
+        delta = {k: stats[k] - logged[k] for k in stats}
+        if delta["superseded"] or delta["dropped"]:
+            log(
+                f"[Mailbox] {delta['received']} received, {delta['applied']} applied, "
+                f"{delta['superseded']} superseded, {delta['dropped']} dropped"
+            )
+        last_log = now
+        logged = stats
+
+# ================================================================
+# RIG STATE FOOTPRINT (compact records, eviction)
+# ================================================================
+# Records keep the agent's JSON shape: it is what the browser, the
+# checkpoint, sharding peers and web workers all consume. Before a record
+# is kept, compact_payload() rebuilds its data with interned dict keys and
+# short strings. "hashrate_hs", "power_watts", thread names, GPU models,
+# miner states and errors then exist once for the whole fleet instead of
+# once per rig and message. A rig's static GPU metadata (uuid, bus id,
+# driver) resolves to the strings its current record already holds, so
+# each new payload's copies are freed at once and only a change is kept.
+#
+# rig_footprint holds each rig's approximate size. evict_thread_main()
+# forgets rigs offline longer than RIG_TTL (seconds, 0 = never) and, while
+# the total is above RIGS_MEMORY_MB (0 = no cap), the rigs offline the
+# longest. Rigs that are online are never evicted. It runs where MQTT is
+# ingested; with WEB_WORKERS > 1 that is the ingest process, which judges
+# liveness from the records (record_is_live()) and sends the workers
+# {"op": "evict"}.
+
+RIG_TTL = float(os.getenv("RIG_TTL", str(7 * 86400)))
+RIGS_MEMORY_MB = float(os.getenv("RIGS_MEMORY_MB", "64"))
+EVICT_INTERVAL = 60
+INTERN_MAX_LEN = 64
+
+rig_footprint: Dict[str, int] = {}   # rig -> approx bytes (guarded by rigs_lock)
+
+FLOAT_SIZE = sys.getsizeof(0.0)
+
+
+def compact_payload(value):
+    """Interned copy of decoded JSON and its approximate size in bytes."""
+    if isinstance(value, dict):
+        out = {}
+        size = 0
+        for key, item in value.items():
+            item, n = compact_payload(item)
+            out[sys.intern(key)] = item
+            size += n
+        return out, size + sys.getsizeof(out)
+
+    if isinstance(value, list):
+        out = []
+        size = 0
+        for item in value:
+            item, n = compact_payload(item)
+            out.append(item)
+            size += n
+        return out, size + sys.getsizeof(out)
+
+    if isinstance(value, str):
+        if len(value) <= INTERN_MAX_LEN:
+            return sys.intern(value), 0  # shared
+        return value, sys.getsizeof(value)
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value, FLOAT_SIZE
+
+    return value, 0  # None / True / False are singletons
+
+
+def forget_rigs(names: List[str]) -> None:
+    global checkpoint_dirty
+    checkpoint_dirty = True
+
+    with known_rigs_lock:
+        known_rigs.difference_update(names)
+
+    with rigs_lock:
+        for rig_name in names:
+            rigs.pop(rig_name, None)
+            rig_footprint.pop(rig_name, None)
+            pruned_data.pop(rig_name, None)
+            offline_deadline.pop(rig_name, None)
+            index_rig(rig_name)
+
+    with history_lock:
+        for rig_name in names:
+            history.pop(rig_name, None)
+
+    for rig_name in names:
+        fleet_update(rig_name, None)
+
+
+def evict_rigs(now: float) -> List[str]:
+    with rigs_lock:
+        # the ingest process (WEB_WORKERS > 1) keeps no offline flags;
+        # judge liveness from the record there and everywhere else alike
+        offline = sorted(
+            (record.get("updated", 0), rig_name)
+            for rig_name, record in rigs.items()
+            if not record.get("online") or not record_is_live(record, now)
+        )
+        sizes = dict(rig_footprint)
+
+    total = sum(sizes.values())
+    cap = RIGS_MEMORY_MB * 1024 * 1024
+    evicted = []
+
+    for updated, rig_name in offline:  # longest offline first
+        expired = RIG_TTL and now - updated > RIG_TTL
+        if not expired and not (cap and total > cap):
+            break  # the rest are newer and the cap holds
+
+        evicted.append(rig_name)
+        total -= sizes.get(rig_name, 0)
+
+    if evicted:
+        forget_rigs(evicted)
+        if INGEST_SERVER:
+            ingest_broadcast({"op": "evict", "rigs": evicted})
+        log(f"[Evict] Forgot {len(evicted)} offline rigs, ~{total // 1024} KiB kept")
+
+    if cap and total > cap:
+        log(f"[Evict] Online rigs alone take ~{total // 1024} KiB, above RIGS_MEMORY_MB={RIGS_MEMORY_MB:g}")
+
+    return evicted
+
+
+def evict_thread_main() -> None:
+    while True:
+        time.sleep(EVICT_INTERVAL)
+        try:
+            evict_rigs(time.time())
+        except Exception as e:
+            log(f"[Evict] Error: {e}")
+
+# ================================================================
+# INGEST SHARDING (MQTT_SHARE_GROUP)
+# ================================================================
+# Dashboards started with the same MQTT_SHARE_GROUP subscribe to
+# $share/<group>/rigcloud/+/status, so the broker hands each status
+# message to only one of them. That instance decodes it, persists its
+# history and queues the finished rig record. Every SYNC_INTERVAL the
+# queued records (latest per rig) go out in one message on
+# rigcloud-sync/<INSTANCE_ID>. All instances apply each other's batches,
+# keeping the newest record per rig, and record them in their history
+# (memory and SQLite) too. Every instance therefore serves the whole
+# fleet, history included.
+#
+# A starting instance sends {"want_full": true}; the others answer with
+# their whole rig table in their next batch. A peer's batch holds the
+# latest record per rig only, so samples one instance ingested within one
+# SYNC_INTERVAL reach the others as one. Give each instance its own
+# HISTORY_DB file. Command records and WS
+# clients stay per instance. Replies reach every instance, and the one
+# that sent the command picks them up.
+
+SYNC_PREFIX = "rigcloud-sync/"
+SYNC_TOPIC = SYNC_PREFIX + "{}"
+
+sync_pending: Dict[str, dict] = {}
+sync_seen: Dict[str, float] = {}   # rig -> last heartbeat, sent as "seen"
+sync_lock = threading.Lock()
+
+
+def sync_queue(rig_name: str, record: dict) -> None:
+    with sync_lock:
+        sync_pending[rig_name] = record
+
+
+def sync_queue_seen(rig_name: str, seen: float) -> None:
+    with sync_lock:
+        sync_seen[rig_name] = seen
+
+
+def sync_request_full() -> None:
+    mqtt_publish(SYNC_TOPIC.format(INSTANCE_ID), {"instance": INSTANCE_ID, "want_full": True})
+
+
+def apply_sync(msg: dict) -> None:
+    if msg.get("instance") == INSTANCE_ID:
+        return  # our own batch
+
+    if msg.get("want_full"):
+        with rigs_lock:
+            table = dict(rigs)
+        with sync_lock:
+            for rig_name, record in table.items():
+                sync_pending.setdefault(rig_name, record)
+        log(f"[Sync] {msg.get('instance')} asked for a full table ({len(table)} rigs)")
+
+    now = time.time()
+    records: Dict[str, dict] = {}
+
+    with rigs_lock:
+        for rig_name, record in (msg.get("rigs") or {}).items():
+            current = rigs.get(rig_name)
+            if current and current.get("updated", 0) >= record.get("updated", 0):
+                continue  # we already have this or something newer
+
+            record["online"] = record_is_live(record, now)
+            records[rig_name] = record
+
+    if records:
+        apply_rig_records(records)
+
+        if INGEST_SERVER:
+            for rig_name, record in records.items():
+                ingest_broadcast({"op": "rig", "rig": rig_name, "record": record})
+
+        schedule_ws_push(now)
+
+    for rig_name, seen in (msg.get("seen") or {}).items():
+        apply_heartbeat(rig_name, seen)
+        if INGEST_SERVER:
+            ingest_broadcast({"op": "seen", "rig": rig_name, "t": seen})
+
+
+def sync_thread_main() -> None:
+    log(f"[Sync] Instance {INSTANCE_ID} in share group {MQTT_SHARE_GROUP}")
+
+    while True:
+        time.sleep(SYNC_INTERVAL)
+
+        with sync_lock:
+            if not sync_pending and not sync_seen:
+                continue
+            batch = dict(sync_pending)
+            seen = dict(sync_seen)
+            sync_pending.clear()
+            sync_seen.clear()
+
+        mqtt_publish(SYNC_TOPIC.format(INSTANCE_ID), {"instance": INSTANCE_ID, "rigs": batch, "seen": seen})
+
+# ================================================================
+# SNAPSHOT CHECKPOINT (warm restarts)
+# ================================================================
+# Known rigs and their last telemetry are written to CHECKPOINT_FILE by a
+# background thread every CHECKPOINT_INTERVAL seconds when something
+# changed: dumped to a .tmp file, fsynced and renamed over the old one,
+# so a crash never leaves half a file. At startup the file is loaded with
+# every entry marked stale ("online": false, "stale": true) so the table
+# is filled straight away; a rig's first telemetry replaces its entry.
+# Once MQTT is up the stale rigs are asked for a refresh one by one,
+# STALE_REFRESH_RATE per second, instead of all at once.
+# CHECKPOINT_FILE="" disables it.
+#
+# The last-viewer prune empties every record's data; what it dropped is
+# kept in pruned_data (until the rig's next record) and written in its
+# place, so a checkpoint taken while nobody watches still has telemetry.
+
+CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE", str(BASE_DIR / "rigcloud_checkpoint.json"))
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", "30"))
+STALE_REFRESH_RATE = float(os.getenv("STALE_REFRESH_RATE", "20"))  # rigs per second
+
+checkpoint_dirty = False
+checkpoint_stop = threading.Event()
+pruned_data: Dict[str, dict] = {}  # rig -> telemetry dropped by the prune
+stale_refresh_started = False
+
+
+def load_checkpoint() -> None:
+    global checkpoint_dirty
+
+    if not CHECKPOINT_FILE or not os.path.exists(CHECKPOINT_FILE):
+        return
+
+    try:
+        with open(CHECKPOINT_FILE, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError) as e:
+        log(f"[Checkpoint] Failed to load {CHECKPOINT_FILE}: {e}")
+        return
+
+    saved_rigs = saved.get("rigs", {})
+    for rig_name, record in saved_rigs.items():
+        record["online"] = False
+        record["stale"] = True
+        record.pop("presence", None)  # re-sent by the broker (retained)
+        apply_rig_record(rig_name, record, history=False, persist=False)
+
+    with known_rigs_lock:
+        known_rigs.update(saved.get("known_rigs", []))
+
+    checkpoint_dirty = False
+    age = time.time() - saved.get("saved", 0)
+    log(f"[Checkpoint] Loaded {len(saved_rigs)} rigs (stale, saved {age:.0f}s ago)")
+
+
+def write_checkpoint() -> None:
+    global checkpoint_dirty
+    checkpoint_dirty = False  # cleared first: updates from now on mark it again
+
+    with rigs_lock:
+        snapshot = {
+            rig_name: {**record, "data": pruned_data[rig_name]}
+            if not record["data"] and rig_name in pruned_data else record
+            for rig_name, record in rigs.items()
+        }
+    with known_rigs_lock:
+        names = sorted(known_rigs)
+
+    tmp = CHECKPOINT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(
+            {"saved": time.time(), "known_rigs": names, "rigs": snapshot},
+            f,
+            separators=(",", ":"),
+            default=json_default,
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, CHECKPOINT_FILE)
+
+
+def checkpoint_thread_main() -> None:
+    log(f"[Checkpoint] Saving rigs to {CHECKPOINT_FILE} every {CHECKPOINT_INTERVAL:g}s")
+
+    while True:
+        stopping = checkpoint_stop.wait(CHECKPOINT_INTERVAL)
+
+        if checkpoint_dirty:
+            try:
+                write_checkpoint()
+            except (OSError, TypeError, ValueError) as e:
+                log(f"[Checkpoint] Write failed: {e}")
+
+        if stopping:
+            break
+
+
+def start_stale_refresh() -> None:
+    global stale_refresh_started
+    if stale_refresh_started:
+        return
+    stale_refresh_started = True
+
+    with rigs_lock:
+        stale = sorted(name for name, record in rigs.items() if record.get("stale"))
+    if stale:
+        threading.Thread(target=stale_refresh_main, args=(stale,), daemon=True).start()
+
+
+def stale_refresh_main(stale: List[str]) -> None:
+    log(f"[Checkpoint] Refreshing {len(stale)} stale rigs, {STALE_REFRESH_RATE:g}/s")
+
+    for rig_name in stale:
+        with rigs_lock:
+            record = rigs.get(rig_name)
+        if not record or not record.get("stale"):
+            continue  # reported (or was reset) in the meantime
+
+        mqtt_publish(
+            f"rigcloud/{rig_name}/cmd",
+            {
+                "id": f"refresh-{int(time.time())}",
+                "command": "refresh"
+            }
+        )
+        time.sleep(1 / STALE_REFRESH_RATE)
+
+# ================================================================
+# MULTI-WORKER INGEST (WEB_WORKERS > 1)
+# ================================================================
+# The main process owns the MQTT connection, the history DB writer and
+# the rig table, and serves no HTTP. uvicorn runs WEB_WORKERS processes of
+# this module; each connects to 127.0.0.1:INGEST_PORT and keeps its own
+# copy of the state, so every worker serves its share of HTTP / WS clients.
+#
+# One JSON object per line. Down to the workers:
+#   {"op": "snapshot", "v", "rigs", "known"}    on connect
+#   {"op": "rig", "v", "rig", "record", "history"?}
+#                                               per telemetry message; presence
+#                                               records carry history: false
+#   {"op": "seen", "v", "rig", "t"}             per heartbeat
+#   {"op": "evict", "v", "rigs"}                offline rigs forgotten
+#   {"op": "cmd_response", "v", "data"}
+#   {"op": "tags" | "reset" | "flightsheet" | "command", ...}
+#                                               relayed from another worker
+# Up from a worker:
+#   {"op": "publish", "topic", "payload", "retain"}
+#   {"op": "relay", "msg"}                      apply in the other workers
+#
+# A worker more than INGEST_QUEUE_MAX messages behind is disconnected; it
+# reconnects and starts again from a snapshot.
+
+INGEST_QUEUE_MAX = 10000
+
+
+def ingest_encode(msg: dict) -> bytes:
+    return (json.dumps(msg, default=json_default, separators=(",", ":")) + "\n").encode()
+
+
+def apply_relay(msg: dict) -> None:
+    """State changes made through one worker's API, replayed elsewhere."""
+    op = msg.get("op")
+
+    if op == "tags":
+        set_rig_tags(msg["rig"], msg["tags"])
+    elif op == "reset":
+        clear_live_state()
+    elif op == "flightsheet":
+        cache_put_flightsheet(msg["id"], msg["rows"])
+    elif op == "command":
+        # replies go out from whichever worker holds the client's socket
+        rec = CommandRecord(msg["id"], msg["command"], msg["targets"], msg["topics"],
+                            msg.get("client"))
+        rec.created = msg["created"]
+        track_command(rec)
+
+# ---------------- ingest process side (threads) ----------------
+
+class IngestPeer:
+    __slots__ = ("sock", "queue")
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.queue: queue.Queue = queue.Queue(maxsize=INGEST_QUEUE_MAX)
+
+
+ingest_peers: List[IngestPeer] = []
+ingest_lock = threading.Lock()
+ingest_version = 0
+ingest_last_all: Dict[str, float] = {}   # all-rig topic -> last passed on
+
+
+def ingest_drop(peer: IngestPeer) -> None:
+    with ingest_lock:
+        if peer not in ingest_peers:
+            return
+        ingest_peers.remove(peer)
+
+    try:
+        peer.queue.put_nowait(None)  # wake the writer
+    except queue.Full:
+        pass  # its next sendall fails instead
+
+    try:
+        peer.sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    peer.sock.close()
+    log(f"[Ingest] Worker disconnected ({len(ingest_peers)} left)")
+
+
+def ingest_broadcast(msg: dict, skip: IngestPeer | None = None) -> None:
+    global ingest_version
+
+    slow = []
+    with ingest_lock:
+        ingest_version += 1
+        msg["v"] = ingest_version
+        data = ingest_encode(msg)
+
+        for peer in ingest_peers:
+            if peer is skip:
+                continue
+            try:
+                peer.queue.put_nowait(data)
+            except queue.Full:
+                slow.append(peer)
+
+    for peer in slow:
+        log("[Ingest] Worker fell behind — dropping it for a resync")
+        ingest_drop(peer)
+
+
+def ingest_peer_writer(peer: IngestPeer) -> None:
+    try:
+        while (data := peer.queue.get()) is not None:
+            peer.sock.sendall(data)
+    except OSError:
+        pass
+    finally:
+        ingest_drop(peer)
+
+
+def ingest_peer_reader(peer: IngestPeer) -> None:
+    try:
+        with peer.sock.makefile("rb") as f:
+            for line in f:
+                msg = json.loads(line)
+                op = msg.get("op")
+
+                if op == "publish":
+                    topic = msg["topic"]
+                    payload = msg["payload"]
+
+                    # every worker's loops ask for refreshes / checks; pass one on
+                    min_gap = 0.0
+                    if topic == CMD_ALL_TOPIC and payload.get("command") == "refresh":
+                        min_gap = BROADCAST_INTERVAL / 2
+                    elif topic == CHECK_ALL_TOPIC:
+                        min_gap = CHECK_INTERVAL / 2
+
+                    if min_gap:
+                        now = time.time()
+                        if now - ingest_last_all.get(topic, 0.0) < min_gap:
+                            continue
+                        ingest_last_all[topic] = now
+
+                    mqtt_publish(topic, payload, msg.get("retain", False))
+
+                elif op == "relay":
+                    apply_relay(msg["msg"])
+                    ingest_broadcast(msg["msg"], skip=peer)
+
+    except (OSError, ValueError) as e:
+        log(f"[Ingest] Worker read error: {e}")
+    finally:
+        ingest_drop(peer)
+
+
+def ingest_server_main() -> None:
+    server = socket.create_server(("127.0.0.1", INGEST_PORT))
+    log(f"[Ingest] Serving {WEB_WORKERS} web workers on 127.0.0.1:{INGEST_PORT}")
+
+    while True:
+        sock, _ = server.accept()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = IngestPeer(sock)
+
+        # snapshot and registration under one lock: no update is lost
+        with ingest_lock:
+            with rigs_lock:
+                snapshot = dict(rigs)
+            with known_rigs_lock:
+                known = sorted(known_rigs)
+
+            peer.queue.put_nowait(ingest_encode({
+                "op": "snapshot", "v": ingest_version, "rigs": snapshot, "known": known,
+            }))
+            ingest_peers.append(peer)
+
+        threading.Thread(target=ingest_peer_writer, args=(peer,), daemon=True).start()
+        threading.Thread(target=ingest_peer_reader, args=(peer,), daemon=True).start()
+        log(f"[Ingest] Worker connected ({len(ingest_peers)} total)")
+
+# ---------------- worker side (asyncio) ----------------
+
+ingest_writer: asyncio.StreamWriter | None = None
+ingest_client_task: asyncio.Task | None = None
+
+
+def ingest_send(msg: dict) -> None:
+    if not (ingest_writer and main_loop):
+        log(f"[Ingest] Not connected — dropped {msg.get('op')}")
+        return
+    main_loop.call_soon_threadsafe(ingest_writer.write, ingest_encode(msg))
+
+
+def ingest_relay(msg: dict) -> None:
+    if RIGCLOUD_WORKER:
+        ingest_send({"op": "relay", "msg": msg})
+
+
+def apply_ingest(msg: dict) -> None:
+    op = msg.get("op")
+    now = time.time()
+
+    if op == "rig":
+        apply_rig_record(msg["rig"], msg["record"], history=msg.get("history", True))
+        schedule_ws_push(now)
+
+    elif op == "snapshot":
+        clear_live_state(keep_history=True)
+        for rig_name, record in msg["rigs"].items():
+            record["online"] = record_is_live(record, now)
+            apply_rig_record(rig_name, record, history=False)
+        with known_rigs_lock:
+            known_rigs.update(msg["known"])
+        log(f"[Ingest] Snapshot v{msg['v']}: {len(msg['rigs'])} rigs")
+
+    elif op == "seen":
+        apply_heartbeat(msg["rig"], msg["t"])
+
+    elif op == "evict":
+        forget_rigs(msg["rigs"])
+
+    elif op == "cmd_response":
+        asyncio.create_task(handle_cmd_response(msg["data"]))
+
+    else:
+        apply_relay(msg)
+
+
+async def ingest_client_loop() -> None:
+    global ingest_writer
+
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", INGEST_PORT, limit=64 * 1024 * 1024
+            )
+        except OSError as e:
+            log(f"[Ingest] Cannot reach ingest process: {e} — retrying in 2s")
+            await asyncio.sleep(2)
+            continue
+
+        ingest_writer = writer
+        log("[Ingest] Connected to ingest process")
+
+        try:
+            while line := await reader.readline():
+                apply_ingest(json.loads(line))
+        except (OSError, ValueError) as e:
+            log(f"[Ingest] Read error: {e}")
+        finally:
+            ingest_writer = None
+            writer.close()
+
+        log("[Ingest] Lost ingest process — reconnecting in 2s")
+        await asyncio.sleep(2)
+
 # ================================================================
 # ENTRY POINT
 # ================================================================
 
 if __name__ == "__main__":
 
+    load_checkpoint()
+
+    threading.Thread(target=mailbox_thread_main, daemon=True).start()
+    threading.Thread(target=evict_thread_main, daemon=True).start()
+
     t = threading.Thread(target=mqtt_thread_main, daemon=True)
     t.start()
-    uvicorn.run(app, host=API_BIND, port=API_PORT, log_level="info")
+
+    checkpoint_thread = None
+    if CHECKPOINT_FILE:
+        checkpoint_thread = threading.Thread(target=checkpoint_thread_main, daemon=True)
+        checkpoint_thread.start()
+
+    history_thread = None
+    if HISTORY_DB:
+        history_thread = threading.Thread(target=history_db_thread_main, daemon=True)
+        history_thread.start()
+
+    if MQTT_SHARE_GROUP:
+        threading.Thread(target=sync_thread_main, daemon=True).start()
+
+    if INGEST_SERVER:
+        threading.Thread(target=ingest_server_main, daemon=True).start()
+
+        # workers import this file by name and connect back to us
+        os.environ["RIGCLOUD_WORKER"] = "1"
+        uvicorn.run(
+            f"{Path(__file__).stem}:app",
+            app_dir=str(BASE_DIR),
+            workers=WEB_WORKERS,
+            host=API_BIND,
+            port=API_PORT,
+            log_level="info",
+        )
+    else:
+        uvicorn.run(app, host=API_BIND, port=API_PORT, log_level="info")
+
+    if history_thread:
+        history_db_stop.set()
+        history_thread.join(timeout=10)
+
+    if checkpoint_thread:
+        checkpoint_stop.set()
+        checkpoint_thread.join(timeout=10)
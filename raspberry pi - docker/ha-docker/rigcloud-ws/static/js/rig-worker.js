@@ -0,0 +1,300 @@
+// =====================================================
+// RIG WORKER
+// =====================================================
+// Owns the dashboard WebSocket. Messages are decoded and merged here, rig
+// view models (rig-view.js) and the action bar totals are derived here,
+// and the UI thread only receives what changed:
+//
+//   { type: "client_id", id }
+//   { type: "cmd_response", response, progress }
+//   { type: "rigs", upsert: { rig: patch }, remove: [rig] }
+//        patch = { cells?: { index: html }, pop?, cpu?, gpu?, online? }
+//   { type: "stats", watts, hash }
+//
+// The UI thread sends { type: "connect", url, interval, snapshot? },
+// { type: "interval", interval } and { type: "selection", rigs }.
+
+importScripts("rig-view.js");
+
+let socket = null;
+let socketUrl = null;
+let interval = 0;          // seconds between pushes asked of the server (0 = live)
+
+let rigs = {};             // rig -> { timestamp, data, online? } as sent by the server
+let fleet = null;          // server-side fleet totals (msg.fleet)
+let selection = [];        // rigs selected in the UI ([] = whole fleet)
+
+const sent = new Map();    // rig -> view model the UI thread has
+const dirty = new Set();   // rigs to re-derive on the next flush
+let fullSync = false;      // a snapshot replaced rigs since the last flush
+let flushScheduled = false;
+let lastStats = null;
+
+// =====================================================
+// UI THREAD MESSAGES
+// =====================================================
+
+onmessage = (event) => {
+    const msg = event.data;
+
+    if (msg.type === "connect") {
+        socketUrl = msg.url;
+        interval = msg.interval;
+
+        // {"rigs", "fleet"} text inlined in index.html by the server
+        if (msg.snapshot) {
+            try {
+                handleMessage(JSON.parse(msg.snapshot));
+            } catch (e) {
+                console.error("Initial snapshot parse error", e);
+            }
+        }
+
+        connect();
+    } else if (msg.type === "interval") {
+        interval = msg.interval;
+        subscribe();
+    } else if (msg.type === "selection") {
+        selection = msg.rigs;
+        postStats();
+    }
+};
+
+// =====================================================
+// WEBSOCKET
+// =====================================================
+
+function connect() {
+    const ws = new WebSocket(socketUrl);
+    socket = ws;
+
+    ws.onopen = () => {
+        if (interval > 0) subscribe();
+    };
+
+    ws.onmessage = (event) => {
+        try {
+            handleMessage(JSON.parse(event.data));
+        } catch (e) {
+            console.error("WS parse error", e);
+        }
+    };
+
+    ws.onclose = () => setTimeout(connect, 5000);
+}
+
+function subscribe() {
+    if (!socket || socket.readyState !== WebSocket.OPEN) return;
+
+    socket.send(JSON.stringify({ type: "subscribe", interval }));
+}
+
+function handleMessage(msg) {
+    /* =====================================================
+       CLIENT ID (first message on connect)
+       ===================================================== */
+    if (msg.client_id) {
+        postMessage({ type: "client_id", id: msg.client_id });
+        return;
+    }
+
+    /* =====================================================
+       COMMAND RESPONSE
+       ===================================================== */
+    if (msg.cmd_response) {
+        postMessage({ type: "cmd_response", response: msg.cmd_response, progress: msg.progress });
+        return;
+    }
+
+    /* =====================================================
+       FLEET TOTALS (sent along with snapshots)
+       ===================================================== */
+    if (msg.fleet) {
+        fleet = msg.fleet;
+        scheduleFlush();
+    }
+
+    /* =====================================================
+       OFFLINE TRANSITIONS (only the rigs that changed)
+       ===================================================== */
+    if (msg.offline) {
+        for (const name of msg.offline) {
+            if (rigs[name]) {
+                rigs[name].online = false;
+                dirty.add(name);
+            }
+        }
+        scheduleFlush();
+        return;
+    }
+
+    /* =====================================================
+       FULL RIG SNAPSHOT
+       ===================================================== */
+    if (msg.rigs) {
+        rigs = msg.rigs;
+        fullSync = true;
+        scheduleFlush();
+        return;
+    }
+
+    /* =====================================================
+       SINGLE RIG UPDATE
+       ===================================================== */
+    if (msg.rig && msg.data) {
+        rigs[msg.rig] = {
+            timestamp: msg.timestamp || Math.floor(Date.now() / 1000),
+            data: msg.data
+        };
+        dirty.add(msg.rig);
+        scheduleFlush();
+        return;
+    }
+
+    /* =====================================================
+       LEGACY PAYLOAD
+       ===================================================== */
+    if (msg.payload && msg.payload.rig) {
+        const r = msg.payload.rig;
+        rigs[r] = {
+            timestamp: msg.payload.timestamp || Math.floor(Date.now() / 1000),
+            data: msg.payload
+        };
+        dirty.add(r);
+        scheduleFlush();
+    }
+}
+
+// =====================================================
+// DIFFS TO THE UI THREAD
+// =====================================================
+// Messages that arrive back to back (a refresh burst) are merged first
+// and posted as one diff.
+
+function scheduleFlush() {
+    if (flushScheduled) return;
+    flushScheduled = true;
+    setTimeout(flush, 0);
+}
+
+function flush() {
+    flushScheduled = false;
+
+    const upsert = {};
+    const remove = [];
+
+    if (fullSync) {
+        fullSync = false;
+
+        for (const name of sent.keys()) {
+            if (!rigs[name]) {
+                sent.delete(name);
+                remove.push(name);
+            }
+        }
+        Object.keys(rigs).forEach(name => dirty.add(name));
+    }
+
+    for (const name of dirty) {
+        if (name === "rigs" || !rigs[name]) continue;
+
+        const patch = diffRig(name, rigs[name]);
+        if (patch) upsert[name] = patch;
+    }
+    dirty.clear();
+
+    if (remove.length > 0 || Object.keys(upsert).length > 0) {
+        postMessage({ type: "rigs", upsert, remove });
+    }
+
+    postStats();
+}
+
+function diffRig(name, entry) {
+    const d = entry.data ?? {};
+    const { cells, pop } = buildRigView(name, entry);
+
+    const next = {
+        cells,
+        pop,
+        cpu: d.cpu_service?.state === "active",
+        gpu: d.gpu_service?.state === "active",
+        online: entry.online !== false,
+        ...rigTotals(d)   // watts / hashrates stay in the worker
+    };
+
+    const prev = sent.get(name);
+    sent.set(name, next);
+
+    if (!prev) {
+        return { cells: { ...cells }, pop, cpu: next.cpu, gpu: next.gpu, online: next.online };
+    }
+
+    const patch = {};
+    let changed = false;
+
+    cells.forEach((html, i) => {
+        if (prev.cells[i] !== html) {
+            (patch.cells ??= {})[i] = html;
+            changed = true;
+        }
+    });
+
+    for (const key of ["pop", "cpu", "gpu", "online"]) {
+        if (prev[key] !== next[key]) {
+            patch[key] = next[key];
+            changed = true;
+        }
+    }
+
+    return changed ? patch : null;
+}
+
+// =====================================================
+// ACTION BAR TOTALS
+// =====================================================
+
+function postStats() {
+    let totalWatts = 0;
+    const algoTotals = {};
+
+    if (selection.length === 0 && fleet) {
+        /* ---------------- Whole fleet: use server totals ---------------- */
+        totalWatts = fleet.total?.watts || 0;
+
+        Object.entries(fleet.algorithms || {}).forEach(([algoName, algo]) => {
+            if (algo.hashrate_hs > 0) {
+                algoTotals[algoName] = algo.hashrate_hs;
+            }
+        });
+    } else {
+        const names = selection.length > 0 ? selection : Array.from(sent.keys());
+
+        names.forEach(name => {
+            const view = sent.get(name);
+            if (!view) return;
+
+            totalWatts += view.watts;
+
+            Object.entries(view.hashrates).forEach(([algoName, hashrate]) => {
+                algoTotals[algoName] = (algoTotals[algoName] || 0) + hashrate;
+            });
+        });
+    }
+
+    const watts =
+        totalWatts > 0
+            ? `GPU W: ${Math.round(totalWatts)}`
+            : "GPU W: --";
+
+    const hashParts = Object.keys(algoTotals)
+        .sort((a, b) => algoTotals[b] - algoTotals[a])
+        .map(algoName => `${algoName}: ${fmtRateHs(algoTotals[algoName], "")}`);
+
+    const hash = hashParts.length > 0 ? hashParts.join(" | ") : "--";
+
+    if (lastStats && lastStats.watts === watts && lastStats.hash === hash) return;
+    lastStats = { watts, hash };
+
+    postMessage({ type: "stats", watts, hash });
+}
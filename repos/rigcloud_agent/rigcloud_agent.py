@@ -8,8 +8,10 @@ import subprocess
 import time
 import urllib.request
 import os
+import signal
 import datetime
-from aiomqtt import Client, MqttError
+from collections import deque
+from aiomqtt import Client, MqttError, Will
 # ================================================================
 # GLOBAL SETTINGS
 # ================================================================
@@ -93,6 +95,13 @@ RIG_NAME = socket.gethostname()
 
 STATUS_TOPIC = f"{TOPIC_PREFIX}/{RIG_NAME}/status"
 
+# Presence: small retained summary, replaced by the last will on a crash
+PRESENCE_TOPIC = f"{TOPIC_PREFIX}/{RIG_NAME}/presence"
+PRESENCE_SUMMARY_KEYS = (
+    "cpu_temp", "cpu_usage", "load", "memory",
+    "gpu_present", "gpus", "cpu_service", "gpu_service",
+)
+
 # Command topics
 CMD_TOPIC_DIRECT = f"{TOPIC_PREFIX}/{RIG_NAME}/cmd"
 CMD_TOPIC_ALL = f"{TOPIC_PREFIX}/all/cmd"
@@ -103,6 +112,15 @@ CHECK_TOPIC_ALL = f"{TOPIC_PREFIX}/all/check"
 
 RESP_TOPIC   = f"{TOPIC_PREFIX}/{RIG_NAME}/cmd_response"
 
+# Group topics (membership is pushed by the dashboard, retained)
+GROUPS_TOPIC = f"{TOPIC_PREFIX}/{RIG_NAME}/groups"
+CMD_TOPIC_GROUP = f"{TOPIC_PREFIX}/group/{{}}/cmd"
+
+joined_groups = set()
+
+# A command may arrive twice (group + direct) while membership settles
+recent_cmd_ids = deque(maxlen=64)
+
 # ================================================================
 # RUN SHELL HELPERS (unchanged)
 # ================================================================
@@ -124,9 +142,39 @@ async def publish_status(mqtt, reason="periodic"):
         telemetry.collect_full_stats
     )
     payload["event"] = reason
+    payload["groups"] = sorted(joined_groups)
     await mqtt.publish(STATUS_TOPIC, json.dumps(payload))
     log(f"Telemetry sent ({reason})")
 
+    await publish_presence(mqtt, payload)
+
+
+async def publish_presence(mqtt, stats=None):
+    payload = {
+        "rig": RIG_NAME,
+        "state": "online",
+        "timestamp": int(time.time()),
+    }
+
+    if stats:
+        payload["timestamp"] = stats.get("timestamp", payload["timestamp"])
+        payload["summary"] = {k: stats[k] for k in PRESENCE_SUMMARY_KEYS if k in stats}
+
+    await mqtt.publish(PRESENCE_TOPIC, json.dumps(payload), qos=1, retain=True)
+
+
+async def publish_offline(mqtt):
+    # a clean disconnect does not fire the will; say it ourselves
+    try:
+        await asyncio.wait_for(
+            mqtt.publish(PRESENCE_TOPIC, json.dumps({"rig": RIG_NAME, "state": "offline"}),
+                         qos=1, retain=True),
+            timeout=3,
+        )
+        log("Presence set offline (shutdown)")
+    except (MqttError, asyncio.TimeoutError) as e:
+        log(f"Could not set presence offline: {e}")
+
 
 # ================================================================
 # ASYNC COMMAND HANDLER (EXTERNAL SCRIPT)
@@ -148,6 +196,12 @@ async def handle_command(raw, mqtt):
         log("Command missing 'command'")
         return
 
+    if "id" in data:
+        if cmd_id in recent_cmd_ids:
+            log(f"Duplicate command ignored ({cmd_id})")
+            return
+        recent_cmd_ids.append(cmd_id)
+
     # ---- DASHBOARD REFRESH (optional legacy support) ----
     if command.strip() == "refresh":
         await publish_status(mqtt, "refresh-request")
@@ -182,6 +236,34 @@ async def handle_command(raw, mqtt):
         log(f"Command execution error: {e}")
 
 
+# ================================================================
+# GROUP MEMBERSHIP
+# ================================================================
+async def update_groups(raw, mqtt):
+    try:
+        groups = set(json.loads(raw).get("groups") or []) if raw else set()
+    except Exception:
+        log("Invalid groups message received")
+        return
+
+    if groups == joined_groups:
+        return
+
+    for group in joined_groups - groups:
+        await mqtt.unsubscribe(CMD_TOPIC_GROUP.format(group))
+        log(f"Left group → {group}")
+
+    for group in groups - joined_groups:
+        await mqtt.subscribe(CMD_TOPIC_GROUP.format(group))
+        log(f"Joined group → {group}")
+
+    joined_groups.clear()
+    joined_groups.update(groups)
+
+    # let the dashboard know it can address us through the groups now
+    asyncio.create_task(publish_status(mqtt, "groups"))
+
+
 # ================================================================
 # Publish check
 # ================================================================
@@ -207,6 +289,13 @@ async def mqtt_loop():
             client_kwargs = {
                 "hostname": BROKER_HOST,
                 "port": BROKER_PORT,
+                # broker publishes this (retained) if we drop off
+                "will": Will(
+                    PRESENCE_TOPIC,
+                    json.dumps({"rig": RIG_NAME, "state": "offline"}),
+                    qos=1,
+                    retain=True,
+                ),
             }
 
             if USE_AWS:
@@ -235,21 +324,41 @@ async def mqtt_loop():
                 log(f"Subscribed → {CHECK_TOPIC_ALL}")
                 log(f"Subscribed → {CHECK_TOPIC_DIRECT}")
 
-                async for msg in mqtt.messages:
-                    topic = str(msg.topic)
-                    payload = msg.payload.decode(errors="ignore")
+                # ---- group membership (retained, re-sent on connect) ----
+                joined_groups.clear()
+                await mqtt.subscribe(GROUPS_TOPIC)
+                log(f"Subscribed → {GROUPS_TOPIC}")
+
+                # ---- presence (retained), then a full status ----
+                await publish_presence(mqtt)
+                asyncio.create_task(publish_status(mqtt, "connect"))
+
+                try:
+                    async for msg in mqtt.messages:
+                        topic = str(msg.topic)
+                        payload = msg.payload.decode(errors="ignore")
+
+                        # ---- GROUP membership ----
+                        if topic == GROUPS_TOPIC:
+                            await update_groups(payload, mqtt)
+                            continue
+
+                        # ---- CHECK requests ----
+                        if topic.endswith("/check"):
+                            asyncio.create_task(publish_check(mqtt))
+                            continue
 
-                    # ---- CHECK requests ----
-                    if topic.endswith("/check"):
-                        asyncio.create_task(publish_check(mqtt))
-                        continue
+                        # ---- COMMAND requests ----
+                        if topic.endswith("/cmd"):
+                            asyncio.create_task(handle_command(payload, mqtt))
+                            continue
 
-                    # ---- COMMAND requests ----
-                    if topic.endswith("/cmd"):
-                        asyncio.create_task(handle_command(payload, mqtt))
-                        continue
+                        log(f"Ignoring message on unexpected topic: {topic}")
 
-                    log(f"Ignoring message on unexpected topic: {topic}")
+                except asyncio.CancelledError:
+                    # shutdown (SIGTERM / SIGINT): leave as offline, not online
+                    await publish_offline(mqtt)
+                    raise
 
         except MqttError as e:
             log(f"MQTT error: {e} — retrying in 3s")
@@ -259,9 +368,18 @@ async def mqtt_loop():
 # MAIN
 # ================================================================
 async def main():
-    await asyncio.gather(
-        mqtt_loop()
-    )
+    # systemctl stop sends SIGTERM: cancel cleanly so presence goes offline
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, task.cancel)
+
+    try:
+        await asyncio.gather(
+            mqtt_loop()
+        )
+    except asyncio.CancelledError:
+        log("Agent stopped")
 
 
 if __name__ == "__main__":
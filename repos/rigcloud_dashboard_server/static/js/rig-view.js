@@ -0,0 +1,1166 @@
+// =====================================================
+// RIG VIEW MODEL
+// =====================================================
+// Turns a rig's status payload into what the dashboard shows: the rig
+// table cells, the docker / miner popover and the per-rig inputs of the
+// action bar totals. Nothing here touches the DOM; the file is loaded by
+// rig-worker.js (importScripts) so all of it runs off the UI thread.
+
+// =====================================================
+// COMPREHENSIVE DATA ACCESS HELPER
+// =====================================================
+
+const DataHelper = {
+    // ================= SYSTEM DATA =================
+    
+    // Get CPU temperature
+    getCpuTemp: (data) => {
+        return data.cpu_temp !== null ? Number(data.cpu_temp) : null;
+    },
+    
+    // Get CPU usage percentage
+    getCpuUsage: (data) => {
+        return data.cpu_usage !== undefined ? data.cpu_usage : "--";
+    },
+    
+    // Get load averages
+    getLoad: (data, interval = "1m") => {
+        return data.load?.[interval] ?? "--";
+    },
+    
+    // Get memory usage
+    getMemory: (data) => {
+        if (data.memory?.total_mb && data.memory.used_mb !== undefined) {
+            return {
+                used_gb: (data.memory.used_mb / 1024).toFixed(1),
+                total_gb: (data.memory.total_mb / 1024).toFixed(1),
+                string: `${(data.memory.used_mb / 1024).toFixed(1)} / ${(data.memory.total_mb / 1024).toFixed(1)}`
+            };
+        }
+        return { used_gb: "--", total_gb: "--", string: "--" };
+    },
+    
+    // ================= GPU DATA =================
+    
+    // Get all GPUs
+    getGpus: (data) => {
+        return Array.isArray(data.gpus) ? data.gpus : [];
+    },
+    
+    // Get primary/first GPU
+    getPrimaryGpu: (data) => {
+        const gpus = DataHelper.getGpus(data);
+        return gpus[0] || {};
+    },
+    
+    // Get GPU temperature
+    getGpuTemp: (gpu) => {
+        return gpu.temp !== undefined ? Number(gpu.temp) : null;
+    },
+    
+    // Get GPU utilization
+    getGpuUtil: (gpu) => {
+        return gpu.util ?? "--";
+    },
+    
+    // Get GPU power
+    getGpuPower: (gpu) => {
+        return gpu.power_watts !== undefined ? gpu.power_watts.toFixed(1) : "--";
+    },
+    
+    // Get GPU fan speed
+    getGpuFan: (gpu) => {
+        return gpu.fan_percent ?? "--";
+    },
+    
+    // Get GPU core clock
+    getGpuCoreClock: (gpu) => {
+        return gpu.sm_clock ?? "--";
+    },
+    
+    // Get GPU memory clock
+    getGpuMemClock: (gpu) => {
+        return gpu.mem_clock ?? "--";
+    },
+    
+    // Get GPU VRAM
+    getGpuVram: (gpu) => {
+        if (gpu.vram_used !== undefined && gpu.vram_total !== undefined) {
+            return {
+                used_gb: (gpu.vram_used / 1024).toFixed(1),
+                total_gb: (gpu.vram_total / 1024).toFixed(1),
+                string: `${(gpu.vram_used / 1024).toFixed(1)} / ${(gpu.vram_total / 1024).toFixed(1)}`
+            };
+        }
+        return { used_gb: "--", total_gb: "--", string: "--" };
+    },
+    
+    // Get GPU driver version
+    getGpuDriverVersion: (gpu) => {
+        return gpu.driver_version || "--";
+    },
+    
+    // Get NVIDIA driver version from first GPU
+    getNvidiaDriverVersion: (data) => {
+        const gpus = DataHelper.getGpus(data);
+        if (gpus.length > 0 && gpus[0].driver_version) {
+            return gpus[0].driver_version;
+        }
+        return "--";
+    },
+    
+    // Get GPU name
+    getGpuName: (gpu) => {
+        return gpu.name || "Unknown GPU";
+    },
+    
+    // Get total GPU power consumption
+    getTotalGpuPower: (data) => {
+        const gpus = DataHelper.getGpus(data);
+        return gpus.reduce((total, gpu) => {
+            return total + (typeof gpu.power_watts === "number" ? gpu.power_watts : 0);
+        }, 0);
+    },
+    
+    // ================= SERVICE DATA =================
+    
+    // Get service status
+    getServiceStatus: (data, service) => {
+        const serviceData = data[service];
+        return {
+            state: serviceData?.state || "unknown",
+            isActive: serviceData?.state === "active",
+            uptime: serviceData?.uptime || 0
+        };
+    },
+    
+    // ================= DOCKER DATA =================
+    
+    // Get docker containers
+    getDockerContainers: (data) => {
+        return Array.isArray(data.docker) ? data.docker : [];
+    },
+    
+    // ================= MINER DATA =================
+    
+    // Miner key to display name mapping
+    MINER_NAMES: {
+        "miner_bzminer": "BzMiner",
+        "miner_xmrig": "XMRig", 
+        "miner_rigel": "Rigel",
+        "miner_lolminer": "lolMiner",
+        "miner_srbminer": "SRBMiner",
+        "miner_wildrig": "WildRig",
+        "miner_onezerominer": "OneZeroMiner",
+        "miner_gminer": "GMiner"
+    },
+    
+    // All miner keys
+    ALL_MINER_KEYS: [
+        "miner_bzminer", "miner_xmrig", "miner_rigel", 
+        "miner_lolminer", "miner_srbminer", "miner_wildrig",
+        "miner_onezerominer", "miner_gminer"
+    ],
+    
+    // Get miner display name
+    getMinerDisplayName: (minerKey) => {
+        return DataHelper.MINER_NAMES[minerKey] || minerKey;
+    },
+    
+    // Get miner data
+    getMiner: (data, minerKey) => {
+        return data[minerKey] || null;
+    },
+    
+    // Check if miner is active
+    isMinerActive: (data, minerKey) => {
+        const miner = DataHelper.getMiner(data, minerKey);
+        return miner && miner.status === "ok" && miner.algorithms && miner.algorithms.length > 0;
+    },
+    
+    // Get all active miners
+    getActiveMiners: (data) => {
+        return DataHelper.ALL_MINER_KEYS
+            .filter(key => DataHelper.isMinerActive(data, key))
+            .map(key => ({
+                key: key,
+                name: DataHelper.getMinerDisplayName(key),
+                data: DataHelper.getMiner(data, key)
+            }));
+    },
+    
+    // Get miner algorithms
+    getMinerAlgorithms: (data, minerKey) => {
+        const miner = DataHelper.getMiner(data, minerKey);
+        if (!miner || miner.status !== "ok") return [];
+        return miner.algorithms || [];
+    },
+    
+    // Get all algorithms from all miners
+    getAllAlgorithms: (data) => {
+        const algorithms = [];
+        const activeMiners = DataHelper.getActiveMiners(data);
+        activeMiners.forEach(miner => {
+            if (miner.data.algorithms) {
+                miner.data.algorithms.forEach(algo => {
+                    algorithms.push({
+                        ...algo,
+                        minerKey: miner.key,
+                        minerName: miner.name,
+                        minerUptime: miner.data.uptime_s,
+                        minerVersion: miner.data.miner_version,
+                        cudaDriver: miner.data.cuda_driver || miner.data.cuda_driver_version
+                    });
+                });
+            }
+        });
+        return algorithms;
+    },
+    
+    // ================= ALGORITHM DATA =================
+    
+    // Get algorithm name
+    getAlgorithmName: (algo) => {
+        return algo.algorithm || "--";
+    },
+    
+    // Get hashrate in H/s
+    getHashrateHS: (algo) => {
+        return algo.hashrate_hs || 0;
+    },
+    
+    // Get CPU hashrate (for SRBMiner)
+    getCpuHashrateHS: (algo) => {
+        return algo.cpu_hashrate_hs || 0;
+    },
+    
+    // Get GPU hashrate (for SRBMiner)
+    getGpuHashrateHS: (algo) => {
+        return algo.gpu_hashrate_hs || 0;
+    },
+    
+    // Get total hashrate (CPU + GPU for SRBMiner)
+    getTotalHashrateHS: (algo) => {
+        const baseHashrate = DataHelper.getHashrateHS(algo);
+        if (baseHashrate > 0) return baseHashrate;
+        
+        // Fallback: sum CPU and GPU for SRBMiner
+        const cpuHashrate = DataHelper.getCpuHashrateHS(algo);
+        const gpuHashrate = DataHelper.getGpuHashrateHS(algo);
+        return cpuHashrate + gpuHashrate;
+    },
+    
+    // Get accepted shares
+    getAcceptedShares: (algo) => {
+        return algo.accepted_shares;
+    },
+    
+    // Get rejected shares
+    getRejectedShares: (algo) => {
+        return algo.rejected_shares;
+    },
+    
+    // Get pool
+    getPool: (algo) => {
+        return algo.pool || "";
+    },
+    
+    // Get workers
+    getWorkers: (algo) => {
+        return algo.workers;
+    },
+    
+    // Get CPU workers (SRBMiner)
+    getCpuWorkers: (algo) => {
+        return algo.cpu_workers;
+    },
+    
+    // Get GPU workers (SRBMiner)
+    getGpuWorkers: (algo) => {
+        return algo.gpu_workers;
+    },
+    
+    // Get pool hashrate (Rigel)
+    getPoolHashrateHS: (algo) => {
+        return algo.pool_hashrate_hs || 0;
+    },
+    
+    // Get CPU threads (XMRig)
+    getCpuThreads: (algo) => {
+        return algo.cpu_threads || 0;
+    },
+    
+    // Get per-thread hashrates
+    getThreadHashrates: (algo) => {
+        return algo.thread_hashrates || {};
+    },
+    
+    // ================= MINER VERSION AND DRIVER INFO =================
+    
+    // Get miner version
+    getMinerVersion: (minerData) => {
+        return minerData?.miner_version || "--";
+    },
+    
+    // Get miner version for a specific miner key
+    getMinerVersionByKey: (data, minerKey) => {
+        const miner = DataHelper.getMiner(data, minerKey);
+        return DataHelper.getMinerVersion(miner);
+    },
+    
+    // Get CUDA driver version
+    getCudaDriverVersion: (minerData) => {
+        return minerData?.cuda_driver_version || minerData?.cuda_driver || "--";
+    },
+    
+    // Get rig name (BzMiner)
+    getMinerRigName: (minerData) => {
+        return minerData?.rig_name || "--";
+    },
+    
+    // Get total devices (BzMiner)
+    getMinerTotalDevices: (minerData) => {
+        return minerData?.total_devices || 0;
+    },
+    
+    // ================= STATISTICS =================
+    
+    // Get total hashrate for all miners
+    getTotalHashrateAllMiners: (data) => {
+        return DataHelper.getAllAlgorithms(data).reduce((total, algo) => {
+            return total + DataHelper.getTotalHashrateHS(algo);
+        }, 0);
+    },
+    
+    // Get hashrate by algorithm
+    getHashrateByAlgorithm: (data) => {
+        const algoMap = {};
+        DataHelper.getAllAlgorithms(data).forEach(algo => {
+            const algoName = DataHelper.getAlgorithmName(algo);
+            const hashrate = DataHelper.getTotalHashrateHS(algo);
+            
+            if (!algoMap[algoName]) {
+                algoMap[algoName] = {
+                    totalHashrate: 0,
+                    miners: [],
+                    perThreadData: []
+                };
+            }
+            
+            algoMap[algoName].totalHashrate += hashrate;
+            
+            // Add miner details with version
+            const minerName = algo.minerName;
+            const minerVersion = algo.minerVersion || "--";
+            
+            // For SRBMiner, break down CPU/GPU
+            if (algo.minerKey === "miner_srbminer") {
+                const cpuHashrate = DataHelper.getCpuHashrateHS(algo);
+                const gpuHashrate = DataHelper.getGpuHashrateHS(algo);
+                
+                if (cpuHashrate > 0) {
+                    algoMap[algoName].miners.push(`CPU ${fmtRateHs(cpuHashrate, "")} ${minerName} v${minerVersion}`);
+                    
+                    // Add per-thread data for CPU
+                    const threadHashrates = DataHelper.getThreadHashrates(algo);
+                    Object.entries(threadHashrates).forEach(([threadName, threadRate]) => {
+                        algoMap[algoName].perThreadData.push({
+                            thread: threadName,
+                            hashrate: threadRate,
+                            type: "CPU",
+                            miner: minerName
+                        });
+                    });
+                }
+                if (gpuHashrate > 0) {
+                    algoMap[algoName].miners.push(`GPU ${fmtRateHs(gpuHashrate, "")} ${minerName} v${minerVersion}`);
+                }
+            } else {
+                const displayText = `${fmtRateHs(hashrate, "")} ${minerName} v${minerVersion}`;
+                algoMap[algoName].miners.push(displayText);
+                
+                // Add per-thread data if available
+                const threadHashrates = DataHelper.getThreadHashrates(algo);
+                Object.entries(threadHashrates).forEach(([threadName, threadRate]) => {
+                    algoMap[algoName].perThreadData.push({
+                        thread: threadName,
+                        hashrate: threadRate,
+                        type: algo.minerKey === "miner_xmrig" ? "CPU" : "GPU",
+                        miner: minerName
+                    });
+                });
+            }
+        });
+        
+        return algoMap;
+    },
+
+    // Get miner summary with versions
+    getMinerSummary: (data) => {
+        const summary = [];
+        DataHelper.getActiveMiners(data).forEach(miner => {
+            const minerData = miner.data;
+            const algorithms = DataHelper.getMinerAlgorithms(data, miner.key);
+            
+            algorithms.forEach(algo => {
+                const totalHashrate = DataHelper.getTotalHashrateHS(algo);
+                const pool = DataHelper.getPool(algo);
+                const accepted = DataHelper.getAcceptedShares(algo) || 0;
+                const rejected = DataHelper.getRejectedShares(algo) || 0;
+                
+                summary.push({
+                    miner: miner.name,
+                    version: DataHelper.getMinerVersion(minerData),
+                    algorithm: DataHelper.getAlgorithmName(algo),
+                    hashrate: totalHashrate,
+                    pool: pool,
+                    accepted: accepted,
+                    rejected: rejected,
+                    uptime: minerData.uptime_s || 0,
+                    threadCount: DataHelper.getCpuThreads(algo) || Object.keys(DataHelper.getThreadHashrates(algo)).length,
+                    cudaDriver: DataHelper.getCudaDriverVersion(minerData)
+                });
+            });
+        });
+        return summary;
+    },
+    
+    // ================= THREAD ANALYSIS =================
+    
+    // Get CPU thread analysis (for CPU miners)
+    getCpuThreadAnalysis: (data) => {
+        const analysis = [];
+        const algorithms = DataHelper.getAllAlgorithms(data);
+        
+        algorithms.forEach(algo => {
+            const threadHashrates = DataHelper.getThreadHashrates(algo);
+            if (Object.keys(threadHashrates).length > 0) {
+                Object.entries(threadHashrates).forEach(([threadName, threadRate]) => {
+                    analysis.push({
+                        algorithm: DataHelper.getAlgorithmName(algo),
+                        miner: algo.minerName,
+                        thread: threadName,
+                        hashrate: threadRate,
+                        formatted: fmtRateHs(threadRate, "")
+                    });
+                });
+            } else if (DataHelper.getCpuThreads(algo) > 0) {
+                // For XMRig which gives thread count but not per-thread rates
+                analysis.push({
+                    algorithm: DataHelper.getAlgorithmName(algo),
+                    miner: algo.minerName,
+                    thread: `${DataHelper.getCpuThreads(algo)} threads`,
+                    hashrate: DataHelper.getTotalHashrateHS(algo),
+                    formatted: fmtRateHs(DataHelper.getTotalHashrateHS(algo), "")
+                });
+            }
+        });
+        
+        return analysis;
+    },
+    
+    // Get per-thread statistics
+    getThreadStatistics: (data) => {
+        const threadData = DataHelper.getCpuThreadAnalysis(data);
+        if (threadData.length === 0) return null;
+        
+        const rates = threadData.map(t => t.hashrate);
+        const total = rates.reduce((sum, rate) => sum + rate, 0);
+        const avg = total / rates.length;
+        
+        return {
+            totalThreads: threadData.length,
+            totalHashrate: total,
+            avgPerThread: avg,
+            minPerThread: Math.min(...rates),
+            maxPerThread: Math.max(...rates)
+        };
+    },
+    
+    // ================= FORMATTING HELPERS =================
+    
+    // Get formatted temperature with CSS class
+    getFormattedTemp: (temp, type = "cpu") => {
+        if (temp === null || temp === undefined) return { value: "--", class: "status-good" };
+        
+        const value = temp.toFixed(0);
+        let className = "status-good";
+        
+        if (type === "cpu" || type === "gpu") {
+            if (temp >= 75) className = "status-hot";
+            else if (temp >= 60) className = "status-warm";
+        }
+        
+        return { value, class: className };
+    },
+    
+    // Get formatted fan speed with CSS class
+    getFormattedFan: (fanPercent) => {
+        if (fanPercent === "--" || fanPercent === undefined) {
+            return { value: "--", class: "status-good" };
+        }
+        
+        let className = "status-good";
+        if (fanPercent >= 80) className = "status-hot";
+        else if (fanPercent >= 50) className = "status-warm";
+        
+        return { value: fanPercent, class: className };
+    },
+    
+    // Get service status with CSS class
+    getFormattedService: (serviceStatus, serviceType = "cpu") => {
+        return {
+            text: serviceType.toUpperCase(), // "CPU" or "GPU"
+            class: serviceStatus.isActive ? "service-ok" : "service-bad"
+        };
+    },
+    
+    // Get formatted miner version
+    getFormattedVersion: (version) => {
+        if (!version || version === "--") return "Unknown";
+        
+        // Extract version number
+        const match = version.match(/(\d+\.\d+(\.\d+)*)/);
+        if (match) {
+            return `v${match[1]}`;
+        }
+        
+        return version;
+    },
+    
+    // Get formatted driver version
+    getFormattedDriver: (driverVersion) => {
+        if (!driverVersion || driverVersion === "--") return "Unknown";
+        
+        // Convert to string if it's not already
+        const driverStr = String(driverVersion);
+        
+        // Clean up driver version
+        let clean = driverStr.replace(/\.0$/, '');
+        
+        // Check if it's a CUDA driver format
+        if (/^\d+\.\d+$/.test(clean)) {
+            return `CUDA ${clean}`;
+        }
+        
+        return clean;
+    }
+};
+
+// =====================================================
+// ADD CIRCULAR DEPENDENCY METHODS AFTER OBJECT IS DEFINED
+// =====================================================
+
+// Now that DataHelper is defined, we can safely reference it
+DataHelper.getCpuShares = (data) => {
+    let accepted = 0;
+    let rejected = 0;
+    
+    const algorithms = DataHelper.getAllAlgorithms(data);
+    algorithms.forEach(algo => {
+        // Check if this is a CPU miner or CPU portion
+        if (algo.minerKey === "miner_xmrig" || 
+            algo.minerKey === "miner_srbminer" || 
+            (algo.minerKey === "miner_srbminer" && DataHelper.getCpuHashrateHS(algo) > 0)) {
+            accepted += DataHelper.getAcceptedShares(algo) || 0;
+            rejected += DataHelper.getRejectedShares(algo) || 0;
+        }
+    });
+    
+    return {
+        accepted: accepted,
+        rejected: rejected,
+        ratio: rejected > 0 ? (rejected / (accepted + rejected)).toFixed(2) : 0,
+        string: `${accepted}/${rejected}`
+    };
+};
+
+DataHelper.getGpuShares = (data) => {
+    let accepted = 0;
+    let rejected = 0;
+    
+    const algorithms = DataHelper.getAllAlgorithms(data);
+    algorithms.forEach(algo => {
+        // Check if this is a GPU miner or GPU portion
+        if (algo.minerKey !== "miner_xmrig" && 
+            !(algo.minerKey === "miner_srbminer" && DataHelper.getCpuHashrateHS(algo) > 0 && DataHelper.getGpuHashrateHS(algo) === 0)) {
+            accepted += DataHelper.getAcceptedShares(algo) || 0;
+            rejected += DataHelper.getRejectedShares(algo) || 0;
+        }
+    });
+    
+    return {
+        accepted: accepted,
+        rejected: rejected,
+        ratio: rejected > 0 ? (rejected / (accepted + rejected)).toFixed(2) : 0,
+        string: `${accepted}/${rejected}`
+    };
+};
+
+DataHelper.getSharesClass = (sharesData) => {
+    if (!sharesData || sharesData.accepted === 0) return "status-unknown";
+    
+    const rejectionRate = sharesData.ratio || 0;
+    
+    if (rejectionRate === 0) return "shares-perfect";        // 0% rejected
+    if (rejectionRate < 0.01) return "shares-good";         // < 1% rejected
+    if (rejectionRate < 0.03) return "shares-warning";      // < 3% rejected
+    return "shares-bad";                                    // >= 3% rejected
+};
+
+DataHelper.getFormattedShares = (sharesData, type = "cpu") => {
+    if (!sharesData || (sharesData.accepted === 0 && sharesData.rejected === 0)) {
+        return {
+            value: "0/0",
+            class: "status-unknown"
+        };
+    }
+    
+    const sharesClass = DataHelper.getSharesClass(sharesData);
+    return {
+        value: `${sharesData.accepted}/${sharesData.rejected}`,
+        class: sharesClass
+    };
+};
+
+DataHelper.getCpuColumnContent = (data) => {
+    const cpuShares = DataHelper.getCpuShares(data);
+    if (cpuShares.accepted > 0 || cpuShares.rejected > 0) {
+        const formatted = DataHelper.getFormattedShares(cpuShares, "cpu");
+        return {
+            html: `<span class="${formatted.class}" title="CPU Shares (Accepted/Rejected)">${formatted.value}</span>`,
+            class: formatted.class
+        };
+    }
+    // Fallback to service status
+    const cpuService = DataHelper.getServiceStatus(data, "cpu_service");
+    const formattedService = DataHelper.getFormattedService(cpuService, "cpu");
+    return {
+        html: `<span class="${formattedService.class}">CPU</span>`,
+        class: formattedService.class
+    };
+};
+
+DataHelper.getGpuColumnContent = (data) => {
+    const gpuShares = DataHelper.getGpuShares(data);
+    if (gpuShares.accepted > 0 || gpuShares.rejected > 0) {
+        const formatted = DataHelper.getFormattedShares(gpuShares, "gpu");
+        return {
+            html: `<span class="${formatted.class}" title="GPU Shares (Accepted/Rejected)">${formatted.value}</span>`,
+            class: formatted.class
+        };
+    }
+    // Fallback to service status
+    const gpuService = DataHelper.getServiceStatus(data, "gpu_service");
+    const formattedService = DataHelper.getFormattedService(gpuService, "gpu");
+    return {
+        html: `<span class="${formattedService.class}">GPU</span>`,
+        class: formattedService.class
+    };
+};
+
+// Also check if getAllAlgorithms has circular dependencies - if it does, move it too
+// But looking at your code, getAllAlgorithms calls getActiveMiners which calls other methods
+// So let's move it as well to be safe:
+
+// First, remove it from the main object (if it's there) and redefine it:
+DataHelper.getAllAlgorithms = (data) => {
+    const algorithms = [];
+    const activeMiners = DataHelper.getActiveMiners(data);
+    activeMiners.forEach(miner => {
+        if (miner.data.algorithms) {
+            miner.data.algorithms.forEach(algo => {
+                algorithms.push({
+                    ...algo,
+                    minerKey: miner.key,
+                    minerName: miner.name,
+                    minerUptime: miner.data.uptime_s,
+                    minerVersion: miner.data.miner_version,
+                    cudaDriver: miner.data.cuda_driver || miner.data.cuda_driver_version
+                });
+            });
+        }
+    });
+    return algorithms;
+};
+
+// =====================================================
+// FORMATTING UTILITIES
+// =====================================================
+
+function hasPositiveRate(hs) {
+    return typeof hs === "number" && hs > 0;
+}
+
+function fmtRateHs(totalHs, label) {
+    if (!totalHs || totalHs <= 0) {
+        return null;
+    }
+
+    if (totalHs >= 1e6) {
+        return `${(totalHs / 1e6).toFixed(2)} MH/s ${label}`;
+    }
+    if (totalHs >= 1e3) {
+        return `${(totalHs / 1e3).toFixed(2)} kH/s ${label}`;
+    }
+    return `${totalHs.toFixed(0)} H/s ${label}`;
+}
+
+function fmtShares(accepted, rejected) {
+    if (accepted === undefined && rejected === undefined) return "--";
+    
+    if (accepted !== undefined && rejected !== undefined) {
+        return `${accepted}/${rejected}`;
+    }
+    
+    if (accepted !== undefined) {
+        return accepted.toString();
+    }
+    
+    return "--";
+}
+
+function fmtXmrig(hs) {
+    return hs > 0
+        ? `${(hs / 1e3).toFixed(1)} kH/s`
+        : null;
+}
+
+function fmtUptime(sec) {
+    if (!sec || sec <= 0) return "--";
+    sec = Math.floor(sec);
+
+    const d = Math.floor(sec / 86400);
+    const h = Math.floor((sec % 86400) / 3600);
+    const m = Math.floor((sec % 3600) / 60);
+
+    if (d > 0) return `${d}d ${h}h`;
+    if (h > 0) return `${h}h ${m}m`;
+    return `${m}m`;
+}
+
+// =====================================================
+// ROW VIEW (rig table cells + popover)
+// =====================================================
+
+function buildRigView(rigName, entry) {
+    const d = entry.data ?? {};
+
+	// Get all active miners
+    const activeMiners = DataHelper.getActiveMiners(d);
+
+    /* ---------------- CPU ---------------- */
+    const cpuTemp = DataHelper.getCpuTemp(d);
+    const cpuTempFormatted = DataHelper.getFormattedTemp(cpuTemp, "cpu");
+    const cpuTempStr = cpuTempFormatted.value;
+    const cpuTempClass = cpuTempFormatted.class;
+    
+    const cpuUtil = DataHelper.getCpuUsage(d);
+    const load1 = DataHelper.getLoad(d, "1m");
+    const load5 = DataHelper.getLoad(d, "5m");
+    const load15 = DataHelper.getLoad(d, "15m");
+    
+    /* ---------------- RAM ---------------- */
+    const memory = DataHelper.getMemory(d);
+    const ramStr = memory.string;
+    
+    /* ---------------- GPU ---------------- */
+    const primaryGpu = DataHelper.getPrimaryGpu(d);
+    const gpuTemp = DataHelper.getGpuTemp(primaryGpu);
+    const gpuTempFormatted = DataHelper.getFormattedTemp(gpuTemp, "gpu");
+    const gpuTempStr = gpuTempFormatted.value;
+    const gpuTempClass = gpuTempFormatted.class;
+    
+    const gpuUtil = DataHelper.getGpuUtil(primaryGpu);
+    const gpuPower = DataHelper.getGpuPower(primaryGpu);
+    const gpuFan = DataHelper.getGpuFan(primaryGpu);
+    const fanFormatted = DataHelper.getFormattedFan(gpuFan);
+    const fanClass = fanFormatted.class;
+    
+    const coreMHz = DataHelper.getGpuCoreClock(primaryGpu);
+    const memMHz = DataHelper.getGpuMemClock(primaryGpu);
+    
+    const vram = DataHelper.getGpuVram(primaryGpu);
+    const vramGB = vram.string;
+    
+    /* ---------------- Services ---------------- */
+    const cpuService = DataHelper.getServiceStatus(d, "cpu_service");
+    const cpuServiceFormatted = DataHelper.getFormattedService(cpuService);
+    const cpuServiceClass = cpuServiceFormatted.class;
+    
+    const gpuService = DataHelper.getServiceStatus(d, "gpu_service");
+    const gpuServiceFormatted = DataHelper.getFormattedService(gpuService);
+    const gpuServiceClass = gpuServiceFormatted.class;
+    
+    /* ---------------- Docker ---------------- */
+    const dockerList = DataHelper.getDockerContainers(d);
+    
+    let dockerLeft = `<div class="docker-header">Docker Containers (${dockerList.length})</div>`;
+    
+    if (dockerList.length === 0) {
+        dockerLeft += "<div style='padding: 10px; color: var(--text-muted); font-style: italic;'>No containers</div>";
+    } else {
+        dockerList.forEach(container => {
+            dockerLeft += `
+                <div class="docker-container">
+                    <div class="docker-name-row">${container.name}</div>
+                    <div class="docker-details-grid">
+                        <div class="docker-detail-item">
+                            <div class="docker-detail-label">Image</div>
+                            <div class="docker-detail-value image">${container.image}</div>
+                        </div>
+                        <div class="docker-detail-item">
+                            <div class="docker-detail-label">Uptime</div>
+                            <div class="docker-detail-value uptime">${fmtUptime(container.uptime_seconds)}</div>
+                        </div>
+                    </div>
+                </div>`;
+        });
+    }
+
+    /* ---------------- Miners ---------------- */
+    let minerRight = "";
+    
+    // Process each miner
+    activeMiners.forEach(miner => {
+        const minerData = miner.data;
+        const minerVersion = DataHelper.getMinerVersion(minerData);
+        const cudaDriver = DataHelper.getCudaDriverVersion(minerData);
+        const algorithms = DataHelper.getMinerAlgorithms(d, miner.key);
+        
+        algorithms.forEach(algo => {
+            const totalHashrate = DataHelper.getTotalHashrateHS(algo);
+            if (totalHashrate > 0) {
+                const algoName = DataHelper.getAlgorithmName(algo);
+                const pool = DataHelper.getPool(algo);
+                const shares = fmtShares(
+                    DataHelper.getAcceptedShares(algo),
+                    DataHelper.getRejectedShares(algo)
+                );
+                
+                // Format miner name with version
+                const minerDisplayName = `${miner.name} ${DataHelper.getFormattedVersion(minerVersion)}`;
+                
+                // Special handling for SRBMiner
+                if (miner.key === "miner_srbminer") {
+                    const cpuHashrate = DataHelper.getCpuHashrateHS(algo);
+                    const gpuHashrate = DataHelper.getGpuHashrateHS(algo);
+                    const cpuWorkers = DataHelper.getCpuWorkers(algo);
+                    const gpuWorkers = DataHelper.getGpuWorkers(algo);
+                    
+                    const cpuRate = cpuHashrate > 0 ? fmtRateHs(cpuHashrate, "") : null;
+                    const gpuRate = gpuHashrate > 0 ? fmtRateHs(gpuHashrate, "") : null;
+                    const totalRate = totalHashrate > 0 ? fmtRateHs(totalHashrate, "") : null;
+                    
+                    // Get per-thread data if available
+                    const threadHashrates = DataHelper.getThreadHashrates(algo);
+                    let threadInfo = "";
+                    if (Object.keys(threadHashrates).length > 0) {
+                        const threadCount = Object.keys(threadHashrates).length;
+                        threadInfo = `<div class="miner-stat-item">
+                            <div class="stat-label">CPU THREADS</div>
+                            <div class="stat-value">${threadCount} threads</div>
+                        </div>`;
+                    } else if (cpuWorkers) {
+                        threadInfo = `<div class="miner-stat-item">
+                            <div class="stat-label">CPU THREADS</div>
+                            <div class="stat-value">${cpuWorkers} workers</div>
+                        </div>`;
+                    }
+                    
+                    minerRight += `
+                        <div class="miner-row-horizontal">
+                            <div class="miner-name-row">${minerDisplayName}</div>
+                            <div class="miner-details-compact">
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">ALGORITHM</div>
+                                    <div class="stat-value">${algoName}</div>
+                                </div>
+                                ${cpuRate ? `
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">CPU HASHRATE</div>
+                                    <div class="stat-value">${cpuRate}</div>
+                                </div>
+                                ` : ""}
+                                ${gpuRate ? `
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">GPU HASHRATE</div>
+                                    <div class="stat-value">${gpuRate}</div>
+                                </div>
+                                ` : ""}
+                                ${totalRate ? `
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">TOTAL HASHRATE</div>
+                                    <div class="stat-value">${totalRate}</div>
+                                </div>
+                                ` : ""}
+                                ${threadInfo}
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">SHARES</div>
+                                    <div class="stat-value">${shares}</div>
+                                </div>
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">UPTIME</div>
+                                    <div class="stat-value">${fmtUptime(miner.data.uptime_s)}</div>
+                                </div>
+                                ${pool ? `
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">POOL</div>
+                                    <div class="stat-value">${pool}</div>
+                                </div>
+                                ` : ""}
+                            </div>
+                        </div>`;
+                }
+                // Special handling for Rigel miner
+                else if (miner.key === "miner_rigel") {
+                    const poolHashrate = DataHelper.getPoolHashrateHS(algo);
+                    const rate = fmtRateHs(totalHashrate, "");
+                    const poolRate = poolHashrate > 0 ? fmtRateHs(poolHashrate, "") : null;
+                    
+                    minerRight += `
+                        <div class="miner-row-horizontal">
+                            <div class="miner-name-row">${minerDisplayName}</div>
+                            <div class="miner-details-compact">
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">ALGORITHM</div>
+                                    <div class="stat-value">${algoName}</div>
+                                </div>
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">LOCAL HASHRATE</div>
+                                    <div class="stat-value">${rate}</div>
+                                </div>
+                                ${poolRate ? `
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">POOL HASHRATE</div>
+                                    <div class="stat-value">${poolRate}</div>
+                                </div>
+                                ` : ""}
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">SHARES</div>
+                                    <div class="stat-value">${shares}</div>
+                                </div>
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">UPTIME</div>
+                                    <div class="stat-value">${fmtUptime(miner.data.uptime_s)}</div>
+                                </div>
+                                ${pool ? `
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">POOL</div>
+                                    <div class="stat-value">${pool}</div>
+                                </div>
+                                ` : ""}
+                            </div>
+                        </div>`;
+                }
+                // Special handling for BzMiner
+                else if (miner.key === "miner_bzminer") {
+                    const rate = fmtRateHs(totalHashrate, "");
+                    const totalDevices = DataHelper.getMinerTotalDevices(minerData);
+                    
+                    let deviceInfo = "";
+                    if (totalDevices > 0) {
+                        deviceInfo = `<div class="miner-stat-item">
+                            <div class="stat-label">DEVICES</div>
+                            <div class="stat-value">${totalDevices}</div>
+                        </div>`;
+                    }
+                    
+                    let bzCudaInfo = "";
+                    const bzCudaDriver = DataHelper.getCudaDriverVersion(minerData);
+                    if (bzCudaDriver && bzCudaDriver !== "--") {
+                        bzCudaInfo = `<div class="miner-stat-item">
+                            <div class="stat-label">CUDA</div>
+                            <div class="stat-value">${DataHelper.getFormattedDriver(bzCudaDriver)}</div>
+                        </div>`;
+                    }
+                    
+                    minerRight += `
+                        <div class="miner-row-horizontal">
+                            <div class="miner-name-row">${minerDisplayName}</div>
+                            <div class="miner-details-compact">
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">ALGORITHM</div>
+                                    <div class="stat-value">${algoName}</div>
+                                </div>
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">HASHRATE</div>
+                                    <div class="stat-value">${rate}</div>
+                                </div>
+                                ${deviceInfo}
+                                ${bzCudaInfo}
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">SHARES</div>
+                                    <div class="stat-value">${shares}</div>
+                                </div>
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">UPTIME</div>
+                                    <div class="stat-value">${fmtUptime(miner.data.uptime_s)}</div>
+                                </div>
+                                ${pool ? `
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">POOL</div>
+                                    <div class="stat-value">${pool}</div>
+                                </div>
+                                ` : ""}
+                            </div>
+                        </div>`;
+                }
+                // Standard miner display
+                else {
+                    const rate = miner.key === "miner_xmrig" 
+                        ? fmtXmrig(totalHashrate)
+                        : fmtRateHs(totalHashrate, "");
+                    
+                    // For XMRig, show thread count
+                    let xmrigThreadInfo = "";
+                    if (miner.key === "miner_xmrig") {
+                        const cpuThreads = DataHelper.getCpuThreads(algo);
+                        if (cpuThreads > 0) {
+                            xmrigThreadInfo = `<div class="miner-stat-item">
+                                <div class="stat-label">CPU THREADS</div>
+                                <div class="stat-value">${cpuThreads}</div>
+                            </div>`;
+                        }
+                    }
+                    
+                    minerRight += `
+                        <div class="miner-row-horizontal">
+                            <div class="miner-name-row">${minerDisplayName}</div>
+                            <div class="miner-details-compact">
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">ALGORITHM</div>
+                                    <div class="stat-value">${algoName}</div>
+                                </div>
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">HASHRATE</div>
+                                    <div class="stat-value">${rate}</div>
+                                </div>
+                                ${xmrigThreadInfo}
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">SHARES</div>
+                                    <div class="stat-value">${shares}</div>
+                                </div>
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">UPTIME</div>
+                                    <div class="stat-value">${fmtUptime(miner.data.uptime_s)}</div>
+                                </div>
+                                ${pool ? `
+                                <div class="miner-stat-item">
+                                    <div class="stat-label">POOL</div>
+                                    <div class="stat-value">${pool}</div>
+                                </div>
+                                ` : ""}
+                            </div>
+                        </div>`;
+                }
+            }
+        });
+    });
+		
+		// Display NVIDIA driver version if available
+    const nvidiaDriver = DataHelper.getNvidiaDriverVersion(d);
+    if (nvidiaDriver && nvidiaDriver !== "--") {
+        /* ----- Header only if something rendered ----- */
+        if (minerRight !== "") {
+        minerRight =
+            `<div class="docker-header">Miners - NVIDIA DRIVER ${DataHelper.getFormattedDriver(nvidiaDriver)}</div>` +
+            minerRight;
+        }
+    }
+		else{
+        /* ----- Header only if something rendered ----- */
+        if (minerRight !== "") {
+        minerRight =
+            `<div class="docker-header">Miners</div>` +
+            minerRight;
+        }
+		}		
+
+
+    /* ---------------- Row Summary ---------------- */
+    const minerSummary = [];
+    
+    activeMiners.forEach(miner => {
+            const algorithms = DataHelper.getMinerAlgorithms(d, miner.key);
+            
+            algorithms.forEach(algo => {
+                    const totalHashrate = DataHelper.getTotalHashrateHS(algo);
+                    
+                    if (totalHashrate > 0) {
+                            if (miner.key === "miner_srbminer") {
+                                    const cpuHashrate = DataHelper.getCpuHashrateHS(algo);
+                                    const gpuHashrate = DataHelper.getGpuHashrateHS(algo);
+                                    
+                                    const parts = [];
+                                    if (cpuHashrate > 0) {
+                                            parts.push(`CPU ${fmtRateHs(cpuHashrate, "")}`);
+                                    }
+                                    if (gpuHashrate > 0) {
+                                            parts.push(`GPU ${fmtRateHs(gpuHashrate, "")}`);
+                                    }
+                                    if (parts.length > 0) {
+                                            minerSummary.push(`SRBMiner ${parts.join(" | ")}`);
+                                    }
+                            } else if (miner.key === "miner_xmrig") {
+                                    minerSummary.push(`${fmtXmrig(totalHashrate)} XMRig`);
+                            } else {
+                                    minerSummary.push(`${fmtRateHs(totalHashrate, miner.name)}`);
+                            }
+                    }
+            });
+    });
+    
+    const finalMinerSummary = minerSummary.filter(Boolean).join(" | ");
+
+    const cpuColumn = DataHelper.getCpuColumnContent(d);
+    const gpuColumn = DataHelper.getGpuColumnContent(d);
+
+    // Cell contents in header order (cells 1-15 of .rig-main)
+    const cells = [
+        `<span class="${cpuTempClass}">${cpuTempStr}</span>`,
+        `${cpuUtil}`,
+        `${load1} / ${load5} / ${load15}`,
+        `${ramStr}`,
+        `<span class="${gpuTempClass}">${gpuTempStr}</span>`,
+        `${gpuUtil}`,
+        `${gpuPower}`,
+        `<span class="${fanClass}">${gpuFan}</span>`,
+        `${vramGB}`,
+        `${coreMHz}`,
+        `${memMHz}`,
+        `${cpuColumn.html}`,
+        `${gpuColumn.html}`,
+        `${dockerList.length}`,
+        `${finalMinerSummary}`
+    ];
+
+    const pop = `
+        <div class="pop-content">
+            <div class="pop-docker">
+                ${dockerLeft}
+            </div>
+            <div class="pop-miners">
+                ${minerRight}
+            </div>
+        </div>
+    `;
+
+    return { cells, pop };
+}
+
+// Per-rig inputs of the action bar totals
+function rigTotals(d) {
+    const hashrates = {};
+
+    DataHelper.getAllAlgorithms(d).forEach(algo => {
+        const algoName = DataHelper.getAlgorithmName(algo);
+        const hashrate = DataHelper.getTotalHashrateHS(algo);
+
+        if (hashrate > 0) {
+            hashrates[algoName] = (hashrates[algoName] || 0) + hashrate;
+        }
+    });
+
+    return { watts: DataHelper.getTotalGpuPower(d), hashrates };
+}
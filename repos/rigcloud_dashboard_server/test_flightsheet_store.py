@@ -0,0 +1,186 @@
+"""
+Behaviour check for the flightsheet stores: the same calls against the
+SQLite store and the DynamoDB store (on an in-memory stub table) must
+give the same rows.
+
+    python -m pytest repos/rigcloud_dashboard_server/test_flightsheet_store.py
+"""
+import os
+import sys
+import tempfile
+from decimal import Decimal
+
+import pytest
+
+TMP = tempfile.mkdtemp(prefix="rigcloud-test-")
+os.environ.update(
+    FLIGHTSHEET_BACKEND="sqlite",
+    FLIGHTSHEET_DB=os.path.join(TMP, "flightsheets.db"),
+    HISTORY_DB="",
+    CHECKPOINT_FILE="",
+    RIG_TAGS_FILE=os.path.join(TMP, "rig_tags.json"),
+)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import rigcloud_dashboard_server as server  # noqa: E402
+
+from boto3.dynamodb.types import TypeDeserializer  # noqa: E402
+
+# ================================================================
+# DYNAMODB STUB
+# ================================================================
+# Just the Table calls DynamoFlightsheetStore makes. Numbers are kept as
+# Decimal like boto3 returns them, and results come in small pages so
+# the LastEvaluatedKey loops run.
+
+class StubBatch:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def put_item(self, Item):
+        self.table.put(Item)
+
+    def delete_item(self, Key):
+        self.table.items.pop((Key["FlightsheetId"], int(Key["GpuId"])), None)
+
+
+class StubClient:
+    def __init__(self, table):
+        self.table = table
+        self.transactions = 0
+
+    def transact_write_items(self, TransactItems):
+        assert len(TransactItems) <= server.DynamoFlightsheetStore.TRANSACTION_LIMIT
+        self.transactions += 1
+        des = TypeDeserializer()
+
+        for action in TransactItems:
+            if "Put" in action:
+                self.table.put({k: des.deserialize(v) for k, v in action["Put"]["Item"].items()})
+            else:
+                key = {k: des.deserialize(v) for k, v in action["Delete"]["Key"].items()}
+                self.table.items.pop((key["FlightsheetId"], int(key["GpuId"])), None)
+
+
+class StubMeta:
+    def __init__(self, table):
+        self.client = StubClient(table)
+
+
+class StubTable:
+    name = "RigCloudFlightsheets"
+    PAGE = 3
+
+    def __init__(self):
+        self.items = {}
+        self.meta = StubMeta(self)
+
+    def put(self, item):
+        item = {k: Decimal(v) if isinstance(v, int) else v for k, v in item.items()}
+        self.items[(item["FlightsheetId"], int(item["GpuId"]))] = item
+
+    def page(self, keys, args):
+        # resume after the last key returned, like DynamoDB does
+        start = args.get("ExclusiveStartKey")
+        keys = [k for k in sorted(keys) if start is None or k > start]
+        resp = {"Items": [dict(self.items[k]) for k in keys[:self.PAGE]]}
+        if len(keys) > self.PAGE:
+            resp["LastEvaluatedKey"] = keys[self.PAGE - 1]
+        return resp
+
+    def scan(self, **args):
+        return self.page(self.items, args)
+
+    def query(self, **args):
+        flightsheet_id = args["KeyConditionExpression"].get_expression()["values"][1]
+        return self.page([k for k in self.items if k[0] == flightsheet_id], args)
+
+    def batch_writer(self):
+        return StubBatch(self)
+
+
+# ================================================================
+# CHECKS (run against both stores)
+# ================================================================
+
+def row(flightsheet_id, gpu, key="kaspa", value="bzminer", updated=1700000000):
+    return {"FlightsheetId": flightsheet_id, "GpuId": gpu, "Key": key, "Value": value, "UpdatedAt": updated}
+
+
+@pytest.fixture(params=["sqlite", "dynamodb"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        store = server.SqliteFlightsheetStore(str(tmp_path / "fs.db"))
+    else:
+        store = server.DynamoFlightsheetStore(StubTable())
+
+    monkeypatch.setattr(server, "flightsheet_store", store)
+    return store
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        server.FlightsheetStore()
+
+
+def test_apply_and_rows(store):
+    store.apply("rig-a", [row("rig-a", 0), row("rig-a", 1, value="lolminer")], [])
+    store.apply("rig-b", [row("rig-b", 0)], [])
+
+    rows = store.rows("rig-a")
+    assert rows == {0: row("rig-a", 0), 1: row("rig-a", 1, value="lolminer")}
+    assert all(type(r["GpuId"]) is int and type(r["UpdatedAt"]) is int for r in rows.values())
+
+    store.apply("rig-a", [row("rig-a", 1, value="gminer", updated=1700000001)], [0])
+    assert store.rows("rig-a") == {1: row("rig-a", 1, value="gminer", updated=1700000001)}
+    assert store.rows("missing") == {}
+
+
+def test_scan(store):
+    store.apply("rig-a", [row("rig-a", gpu) for gpu in range(4)], [])
+    store.apply("rig-b", [row("rig-b", 0)], [])
+
+    scanned = sorted(store.scan(), key=server.flightsheet_key)
+    assert scanned == [row("rig-a", gpu) for gpu in range(4)] + [row("rig-b", 0)]
+
+
+def test_delete(store):
+    store.apply("rig-a", [row("rig-a", gpu) for gpu in range(5)], [])
+    store.apply("rig-b", [row("rig-b", 0)], [])
+
+    assert store.delete("rig-a") == 5
+    assert store.rows("rig-a") == {}
+    assert store.rows("rig-b") == {0: row("rig-b", 0)}
+    assert store.delete("rig-a") == 0
+
+
+def test_large_apply(store):
+    # over TRANSACTION_LIMIT: DynamoDB falls back to a batch write
+    limit = server.DynamoFlightsheetStore.TRANSACTION_LIMIT
+    puts = [row("rig-a", gpu) for gpu in range(limit + 20)]
+    store.apply("rig-a", puts, [])
+    store.apply("rig-a", [], list(range(10)))
+
+    assert store.rows("rig-a") == {item["GpuId"]: item for item in puts[10:]}
+    if isinstance(store, server.DynamoFlightsheetStore):
+        assert store.table.meta.client.transactions == 1  # only the delete
+
+
+def test_save_diff_keeps_unchanged_rows(store):
+    store.apply("rig-a", [row("rig-a", 0), row("rig-a", 1), row("rig-a", 2)], [])
+
+    edited = [
+        row("rig-a", 0, updated=1800000000),                   # same Key / Value
+        row("rig-a", 1, value="lolminer", updated=1800000000),  # changed
+    ]
+    deleted, written, rows = server.save_flightsheet_diff("rig-a", edited)
+
+    assert (deleted, written) == (1, 1)
+    assert rows == [row("rig-a", 0), row("rig-a", 1, value="lolminer", updated=1800000000)]
+    assert store.rows("rig-a") == {item["GpuId"]: item for item in rows}